@@ -0,0 +1,129 @@
+"""
+Request Batching Module
+Coalesces concurrent upscale requests into batched backend calls
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, List, Optional
+
+
+class BatchScheduler:
+    """Collects concurrent submissions and runs each bucket through one batched call
+
+    Batches are pipelined: while one batch executes, the next one is collected
+    and prepared (e.g. staged and uploaded to the GPU) so the device never
+    waits on host-side work between batches.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[Any], List[Any]],
+        max_batch_size: int = 4,
+        max_wait_ms: float = 10,
+        bucket_key: Optional[Callable[[Any], Hashable]] = None,
+        prepare_batch: Optional[Callable[[List[Any]], Any]] = None,
+        max_in_flight: int = 2,
+        executor: Optional[ThreadPoolExecutor] = None
+    ):
+        """
+        Args:
+            process_batch: Blocking function mapping a prepared batch to a list of results;
+                an Exception in the list fails only its own item
+            max_batch_size: Maximum items per batched call
+            max_wait_ms: How long to wait for more items after the first one arrives
+            bucket_key: Items with different keys (e.g. shapes) are never batched together
+            prepare_batch: Blocking function run ahead of process_batch (defaults to identity)
+            max_in_flight: Batches that may be prepared or executing at the same time
+            executor: Single-thread executor that runs process_batch (defaults to a private one)
+        """
+        self.process_batch = process_batch
+        self.prepare_batch = prepare_batch or (lambda items: items)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.bucket_key = bucket_key or (lambda item: None)
+        self.max_in_flight = max_in_flight
+
+        # Single worker thread owns the device, so batches never overlap;
+        # a second thread prepares the next batch meanwhile
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.prepare_executor = ThreadPoolExecutor(max_workers=1)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = set()
+
+    async def submit(self, item: Any) -> Any:
+        """Queue an item and wait for its result"""
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._task = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        """Collect items for up to max_wait after the first one, then prepare and dispatch per bucket"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            for group in self._group(batch):
+                await self._slots.acquire()
+                items = [item for item, _ in group]
+                try:
+                    prepared = await loop.run_in_executor(self.prepare_executor, self.prepare_batch, items)
+                except Exception as e:
+                    self._slots.release()
+                    self._fail(group, e)
+                    continue
+
+                # Don't await execution: the loop goes on to collect and prepare the next batch
+                task = loop.create_task(self._execute(group, prepared))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+
+    def _group(self, batch: list) -> list:
+        """Split a batch into buckets, dropping requests that were cancelled while queued"""
+        groups = {}
+        for item, future in batch:
+            if not future.cancelled():
+                groups.setdefault(self.bucket_key(item), []).append((item, future))
+        return list(groups.values())
+
+    def _fail(self, group: list, error: Exception):
+        """Propagate an error to every request in a bucket"""
+        for _, future in group:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _execute(self, group: list, prepared: Any):
+        """Run one prepared bucket in the worker thread and resolve its futures"""
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.process_batch, prepared)
+        except Exception as e:
+            self._fail(group, e)
+            return
+        finally:
+            self._slots.release()
+
+        for (_, future), result in zip(group, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
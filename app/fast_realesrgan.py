@@ -0,0 +1,352 @@
+"""
+Fast Real-ESRGAN Inference Module
+RealESRGANer subclass that keeps post-processing on the inference device
+"""
+
+import os
+import math
+from typing import List, Optional
+
+import cv2
+import numpy as np
+import torch
+from torch.nn import functional as F
+from realesrgan import RealESRGANer
+
+
+# Activation memory of RRDBNet relative to a 3-channel float32 output tile
+TILE_OVERHEAD_FACTOR = 64
+MIN_TILE_SIZE = 32
+
+# channels_last hits the fastest FP16 cuDNN convs on most GPUs but regresses on some; CHANNELS_LAST=0 opts out
+CHANNELS_LAST = os.environ.get("CHANNELS_LAST", "1") == "1"
+
+# Same-shaped tiles stacked into one forward pass when tiling large images
+TILE_BATCH_SIZE = int(os.environ.get("TILE_BATCH_SIZE", "4"))
+
+# Model inputs (whole images and tiles) are padded up to a multiple of this, so a compiled model
+# sees a bounded set of shapes instead of recompiling and capturing a new CUDA graph per image size
+SHAPE_BUCKET = 64
+
+# Largest uint8 result batch copied to the host through pinned memory (page-locked RAM is
+# kept by torch's host cache, so bigger results use a pageable copy)
+PINNED_OUTPUT_MAX_BYTES = int(os.environ.get("PINNED_OUTPUT_MAX_MB", "64")) * 1024 * 1024
+
+# cuDNN autotunes conv algorithms per input shape and caches the choice; tiles repeat a
+# handful of shapes, so the search is paid once (CUDNN_BENCHMARK=0 if input sizes vary a lot)
+torch.backends.cudnn.benchmark = os.environ.get("CUDNN_BENCHMARK", "1") == "1"
+
+# Allow TF32 tensor cores for float32 convs and matmuls (Ampere and newer)
+torch.backends.cudnn.allow_tf32 = True
+torch.backends.cuda.matmul.allow_tf32 = True
+
+
+def select_tile_settings(scale: int = 4) -> tuple:
+    """
+    Pick tile size and overlap from the free VRAM
+
+    Overlapping tiles keep peak VRAM bounded for large inputs; the tile_pad
+    overlap is cropped off each upscaled tile to hide seams.
+
+    Args:
+        scale: Network upscale factor
+
+    Returns:
+        tuple: (tile, tile_pad)
+    """
+    if not torch.cuda.is_available():
+        return 400, 10
+
+    # Budget 60% of free memory for one tile's activations
+    free, _ = torch.cuda.mem_get_info()
+    tile = int(math.sqrt(free * 0.6 / (scale * scale * 3 * 4 * TILE_OVERHEAD_FACTOR)))
+    tile = max(tile // 32 * 32, MIN_TILE_SIZE)
+    return tile, 16 if tile >= 256 else 8
+
+
+def compile_model(upscaler: RealESRGANer):
+    """
+    Compile the upscaler's network with torch.compile (CUDA and PyTorch 2+ only)
+
+    Runs a warmup pass so compilation happens now instead of on the first request.
+    """
+    if not torch.cuda.is_available() or int(torch.__version__.split('.')[0]) < 2:
+        return
+
+    model = upscaler.model
+    if CHANNELS_LAST:
+        model = model.to(memory_format=torch.channels_last)
+    upscaler.model = torch.compile(model, mode='reduce-overhead')
+
+    upscaler.enhance(np.zeros((64, 64, 3), dtype=np.uint8))
+
+
+class FastRealESRGANer(RealESRGANer):
+    """RealESRGANer with batched inference and uint8 quantization done on GPU"""
+
+    tile_batch_size = TILE_BATCH_SIZE
+    # Images within one tile's pixel budget skip tiling; off for models with a capped input shape
+    one_pass = True
+
+    def upload(self, imgs: List[np.ndarray], rgb: bool = False) -> tuple:
+        """
+        Stage same-sized 8-bit BGR (or RGB if rgb) images on the device without waiting for the copy
+
+        Returns:
+            tuple: (NCHW RGB device tensor, CUDA event marking upload completion or None)
+        """
+        # The channel flip is a strided view, folded into the one copy into the staging buffer
+        batch = np.stack(imgs)
+        batch = (batch if rgb else batch[..., ::-1]).transpose(0, 3, 1, 2)
+
+        if self.device.type != 'cuda':
+            img = torch.from_numpy(np.ascontiguousarray(batch)).to(self.device).float().div_(255.0)
+            return (img.half() if self.half else img), None
+
+        # Pinned host memory + a side stream let the upload overlap the running batch
+        if not hasattr(self, 'upload_stream'):
+            self.upload_stream = torch.cuda.Stream(self.device)
+            self.staging = [torch.empty(0, dtype=torch.uint8).pin_memory() for _ in range(2)]
+            self.staging_events = [None, None]
+            self.staging_index = 0
+
+        # Two pinned staging buffers (grown on demand) used in turn, so the next batch is staged
+        # while the previous upload may still be reading from the other one
+        index = self.staging_index
+        self.staging_index = 1 - index
+        if self.staging_events[index] is not None:
+            self.staging_events[index].synchronize()
+        if self.staging[index].numel() < batch.size:
+            self.staging[index] = torch.empty(batch.size, dtype=torch.uint8).pin_memory()
+        host = self.staging[index][:batch.size].view(batch.shape)
+        np.copyto(host.numpy(), batch)
+
+        with torch.cuda.stream(self.upload_stream):
+            img = host.to(self.device, non_blocking=True)
+            img = img.half().div_(255.0) if self.half else img.float().div_(255.0)
+            event = torch.cuda.Event()
+            event.record(self.upload_stream)
+        self.staging_events[index] = event
+        return img, event
+
+    def pre_process(self, img):
+        """Move an HxWx3 float RGB array (or an uploaded NCHW tensor) to the device and pad it"""
+        if isinstance(img, np.ndarray):
+            img = torch.from_numpy(np.transpose(img, (2, 0, 1))).float().unsqueeze(0).to(self.device)
+            if self.half:
+                img = img.half()
+        self.img = img
+
+        # pre_pad
+        if self.pre_pad != 0:
+            self.img = F.pad(self.img, (0, self.pre_pad, 0, self.pre_pad), 'reflect')
+        # mod pad for divisible borders
+        if self.scale == 2:
+            self.mod_scale = 2
+        elif self.scale == 1:
+            self.mod_scale = 4
+        if self.mod_scale is not None:
+            self.mod_pad_h, self.mod_pad_w = 0, 0
+            _, _, h, w = self.img.size()
+            if h % self.mod_scale != 0:
+                self.mod_pad_h = self.mod_scale - h % self.mod_scale
+            if w % self.mod_scale != 0:
+                self.mod_pad_w = self.mod_scale - w % self.mod_scale
+            self.img = F.pad(self.img, (0, self.mod_pad_w, 0, self.mod_pad_h), 'reflect')
+
+    def _fits_one_pass(self) -> bool:
+        """
+        Whether the padded batch fits the pixel budget of a single tile
+
+        The tile size is sized for memory, not shape: a wide or tall image with
+        fewer pixels than one square tile runs in one pass instead of being split.
+        """
+        batch, _, height, width = self.img.shape
+        height += -height % SHAPE_BUCKET
+        width += -width % SHAPE_BUCKET
+        return batch * height * width <= self.tile_size * self.tile_size
+
+    def _run_model(self, img: torch.Tensor, max_side: Optional[int] = None) -> torch.Tensor:
+        """
+        Run the model on img padded up to a multiple of SHAPE_BUCKET (at most max_side per side)
+
+        The padding is replicated edge pixels and its upscaled part is cropped off again.
+        """
+        _, _, height, width = img.shape
+        padded_height = height + -height % SHAPE_BUCKET
+        padded_width = width + -width % SHAPE_BUCKET
+        if max_side is not None:
+            padded_height = max(min(padded_height, max_side), height)
+            padded_width = max(min(padded_width, max_side), width)
+        if padded_height != height or padded_width != width:
+            img = F.pad(img, (0, padded_width - width, 0, padded_height - height), 'replicate')
+        return self.model(img)[:, :, :height * self.scale, :width * self.scale]
+
+    def process(self):
+        """Untiled inference, with the input padded to a shape bucket"""
+        self.output = self._run_model(self.img)
+
+    def tile_process(self):
+        """
+        Overlap-tile inference like RealESRGANer.tile_process, but errors such as OOM propagate
+
+        Tiles with the same padded shape (all interior ones) are stacked and run
+        through the model tile_batch_size at a time instead of one by one, and
+        edge tiles are padded to a shape bucket (see _run_model).
+        """
+        batch, channel, height, width = self.img.shape
+        self.output = self.img.new_zeros((batch, channel, height * self.scale, width * self.scale))
+        tiles_x = math.ceil(width / self.tile_size)
+        tiles_y = math.ceil(height / self.tile_size)
+
+        # Group tiles by padded input shape so each group can be stacked
+        groups = {}
+        for y in range(tiles_y):
+            for x in range(tiles_x):
+                # input tile area on total image
+                start_x = x * self.tile_size
+                end_x = min(start_x + self.tile_size, width)
+                start_y = y * self.tile_size
+                end_y = min(start_y + self.tile_size, height)
+
+                # input tile area with padding
+                pad_start_x = max(start_x - self.tile_pad, 0)
+                pad_end_x = min(end_x + self.tile_pad, width)
+                pad_start_y = max(start_y - self.tile_pad, 0)
+                pad_end_y = min(end_y + self.tile_pad, height)
+
+                shape = (pad_end_y - pad_start_y, pad_end_x - pad_start_x)
+                groups.setdefault(shape, []).append(
+                    (start_x, end_x, start_y, end_y, pad_start_x, pad_end_x, pad_start_y, pad_end_y)
+                )
+
+        for tiles in groups.values():
+            for i in range(0, len(tiles), self.tile_batch_size):
+                chunk = tiles[i:i + self.tile_batch_size]
+                # Edge tiles are padded to a shape bucket, no larger than a full padded tile
+                output_tiles = self._run_model(torch.cat([
+                    self.img[:, :, pad_start_y:pad_end_y, pad_start_x:pad_end_x]
+                    for _, _, _, _, pad_start_x, pad_end_x, pad_start_y, pad_end_y in chunk
+                ]), max_side=self.tile_size + 2 * self.tile_pad)
+
+                for j, (start_x, end_x, start_y, end_y, pad_start_x, _, pad_start_y, _) in enumerate(chunk):
+                    output_tile = output_tiles[j * batch:(j + 1) * batch]
+
+                    # crop the padding off and put the tile into the output image
+                    tile_x = (start_x - pad_start_x) * self.scale
+                    tile_y = (start_y - pad_start_y) * self.scale
+                    tile_w = (end_x - start_x) * self.scale
+                    tile_h = (end_y - start_y) * self.scale
+                    self.output[:, :, start_y * self.scale:end_y * self.scale, start_x * self.scale:end_x * self.scale] = \
+                        output_tile[:, :, tile_y:tile_y + tile_h, tile_x:tile_x + tile_w]
+
+    @torch.inference_mode()
+    def run_batch(self, uploaded: tuple, outscale: Optional[float] = None, rgb: bool = False) -> List[np.ndarray]:
+        """
+        Upscale a batch staged by upload()
+
+        Args:
+            uploaded: (tensor, event) as returned by upload()
+            outscale: Final scale relative to the input (defaults to the network scale)
+            rgb: Return RGB instead of BGR arrays
+
+        Returns:
+            list: HxWx3 uint8 BGR (or RGB) arrays at outscale
+        """
+        img, event = uploaded
+        if event is not None:
+            torch.cuda.current_stream().wait_event(event)
+            img.record_stream(torch.cuda.current_stream())
+
+        h_input, w_input = img.shape[2:]
+        self.pre_process(img)
+        while True:
+            try:
+                # inference_mode skips autograd bookkeeping entirely; autocast keeps every
+                # CUDA op on fp16 tensor-core kernels, including ones that would upcast
+                tiled = self.tile_size > 0 and not (self.one_pass and self._fits_one_pass())
+                with torch.autocast(device_type='cuda', dtype=torch.float16, enabled=self.device.type == 'cuda'):
+                    if tiled:
+                        self.tile_process()
+                    else:
+                        self.process()
+                break
+            except torch.cuda.OutOfMemoryError:
+                # The tile estimate was too optimistic, retry with fewer tiles per pass, then smaller
+                # tiles; a one-pass run doesn't stack tiles, so it goes straight to smaller tiles
+                batched = tiled and self.tile_batch_size > 1
+                if self.tile_size <= MIN_TILE_SIZE and not batched:
+                    raise
+                torch.cuda.empty_cache()
+                if batched:
+                    self.tile_batch_size //= 2
+                    print(f"CUDA out of memory, retrying with {self.tile_batch_size} tiles per pass")
+                else:
+                    self.tile_size = max(self.tile_size // 2, MIN_TILE_SIZE)
+                    print(f"CUDA out of memory, retrying with tile size {self.tile_size}")
+        output = self.post_process()
+
+        # Resize to the requested scale on device, before quantizing, instead of on host afterwards.
+        # It stays in the model's dtype: an fp32 copy of a 4x output (and its 8x result) would take
+        # several times its memory. If it still runs out, the host resizes the quantized arrays
+        host_size = None
+        if outscale is not None and outscale != float(self.scale):
+            size = (int(h_input * outscale), int(w_input * outscale))
+            try:
+                output = F.interpolate(output, size=size, mode='bicubic', antialias=True)
+            except torch.cuda.OutOfMemoryError:
+                torch.cuda.empty_cache()
+                print("CUDA out of memory while resizing, resizing on the host instead")
+                host_size = size
+
+        # Quantize and reorder RGB/BCHW -> BGR/BHWC on device, then a single contiguous copy to host
+        output = output.clamp_(0, 1).mul_(255.0).round_().to(torch.uint8)
+        if not rgb:
+            output = output[:, [2, 1, 0]]
+        output = output.permute(0, 2, 3, 1).contiguous()
+        results = self._to_host(output)
+        if host_size is not None:
+            results = [
+                cv2.resize(result, (host_size[1], host_size[0]), interpolation=cv2.INTER_LANCZOS4)
+                for result in results
+            ]
+        return results
+
+    def _to_host(self, output: torch.Tensor) -> List[np.ndarray]:
+        """Copy a BHWC uint8 batch to host memory as a list of arrays"""
+        if output.device.type != 'cuda':
+            return list(output.numpy())
+
+        # Copy small results into pinned memory (from torch's caching host allocator) at full PCIe
+        # bandwidth instead of through the driver's pageable bounce buffer. The cache never returns
+        # blocks to the OS, so large results (and failed pinned allocations) take a pageable copy
+        if output.numel() <= PINNED_OUTPUT_MAX_BYTES:
+            try:
+                host = torch.empty(output.shape, dtype=torch.uint8, pin_memory=True)
+            except RuntimeError:
+                host = None
+            if host is not None:
+                host.copy_(output, non_blocking=True)
+                torch.cuda.current_stream().synchronize()
+                return list(host.numpy())
+        return list(output.cpu().numpy())
+
+    def enhance_batch(self, imgs: List[np.ndarray], outscale: Optional[float] = None, rgb: bool = False) -> List[np.ndarray]:
+        """Upscale same-sized 8-bit BGR (or RGB if rgb) images in a single forward pass"""
+        return self.run_batch(self.upload(imgs, rgb), outscale, rgb)
+
+    def enhance(self, img, outscale=None, alpha_upsampler='realesrgan'):
+        """
+        Upscale an 8-bit BGR image
+
+        Args:
+            img: HxWx3 uint8 BGR array (other layouts use the stock implementation)
+            outscale: Final scale relative to the input (defaults to the network scale)
+
+        Returns:
+            tuple: (HxWx3 uint8 BGR array, image mode)
+        """
+        if img.ndim != 3 or img.shape[2] != 3 or img.dtype != np.uint8:
+            return super().enhance(img, outscale, alpha_upsampler)
+
+        return self.enhance_batch([img], outscale)[0], 'RGB'
@@ -5,20 +5,55 @@ Support for both file upload and base64 input
 """
 
 import os
-import uuid
-import base64
+import json
+import mmap
+import importlib
+import shutil
+import asyncio
+import binascii
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Optional
 
+import numpy as np
 import uvicorn
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
 from PIL import Image
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
-from app.upscaler_simple import RealESRGANUpscaler
+from app.request_encoding import DecompressRequestMiddleware
+from app.result_cache import DIGEST_NAME, ResultCache
+
+# Upscaler implementation, selected once at import:
+#   simple - Real-ESRGAN Python with PIL fallback (default)
+#   hybrid - NCNN-Vulkan binary, else Real-ESRGAN Python with request batching
+#   ncnn   - NCNN-Vulkan binary only
+UPSCALER_MODULES = {
+    "simple": "app.upscaler_simple",
+    "hybrid": "app.upscaler_hybrid",
+    "ncnn": "app.upscaler"
+}
+UPSCALER_BACKEND = os.environ.get("UPSCALER_BACKEND", "simple")
+if UPSCALER_BACKEND not in UPSCALER_MODULES:
+    raise Exception(f"Unknown UPSCALER_BACKEND '{UPSCALER_BACKEND}', expected one of: {', '.join(UPSCALER_MODULES)}")
+RealESRGANUpscaler = importlib.import_module(UPSCALER_MODULES[UPSCALER_BACKEND]).RealESRGANUpscaler
+
+# pybase64 is a SIMD drop-in for the stdlib codec, several times faster on MB-sized payloads
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# orjson serializes the multi-MB base64 strings several times faster than json
+try:
+    import orjson
+    DefaultResponse = ORJSONResponse
+except ImportError:
+    orjson = None
+    DefaultResponse = JSONResponse
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -26,21 +61,14 @@ app = FastAPI(
     description="AI Image Upscaling API using Real-ESRGAN (Multiple backends with fallbacks)",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
-)
-
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    redoc_url="/redoc",
+    default_response_class=DefaultResponse
 )
 
 # Pydantic models for base64 endpoint
 class UpscaleBase64Request(BaseModel):
-    image_base64: str
+    # 2MB of image is ~2.8M base64 characters; the cap fails longer strings in pydantic-core
+    image_base64: str = Field(max_length=3_000_000)
     scale: int = 4
     model: Optional[str] = None
     format: str = "auto"  # auto, jpeg, png
@@ -61,8 +89,82 @@ class UpscaleResponse(BaseModel):
 # Initialize upscaler
 upscaler = RealESRGANUpscaler()
 
-# Ensure temp directory exists
-Path("temp").mkdir(exist_ok=True)
+
+@app.on_event("startup")
+async def preload_model():
+    """Warm up the backend's model in the serving process (after any worker fork)"""
+    if hasattr(upscaler, "preload"):
+        await upscaler.preload()
+
+# Temp directory for NCNN input/output files (mount it on tmpfs to avoid disk I/O)
+# resolved once at startup so per-request slot paths are absolute
+TEMP_DIR = str(Path(os.environ.get("TEMP_DIR", "temp")).resolve())
+Path(TEMP_DIR).mkdir(exist_ok=True)
+
+# Upload limit for both endpoints
+MAX_IMAGE_BYTES = 2 * 1024 * 1024
+
+# Disk cache of encoded results for repeated inputs (RESULT_CACHE_MB=0 disables it)
+RESULT_CACHE_MB = int(os.environ.get("RESULT_CACHE_MB", "256"))
+result_cache = None
+if RESULT_CACHE_MB > 0:
+    result_cache = ResultCache(os.environ.get("RESULT_CACHE_DIR", "cache"), RESULT_CACHE_MB * 1024 * 1024)
+
+# Thread pool for blocking decode/encode/file work in request handlers
+executor = ThreadPoolExecutor(max_workers=min(os.cpu_count() or 1, 4))
+
+# Reusable temp file slots for the NCNN binary; they also bound how many passes can be batched together
+NCNN_SLOTS = int(os.environ.get("NCNN_SLOTS", "4"))
+ncnn_slots = asyncio.Queue()
+for i in range(NCNN_SLOTS):
+    ncnn_slots.put_nowait(os.path.join(TEMP_DIR, f"slot_{i}"))
+
+# Formats accepted by _is_supported_image; Pillow is told to try only these decoders
+IMAGE_FORMATS = ["PNG", "JPEG", "WEBP"]
+
+# Input formats the NCNN binary decodes itself, with their file extensions
+NCNN_INPUT_EXTENSIONS = {"PNG": "png", "JPEG": "jpg", "WEBP": "webp"}
+
+# Image types served as raw response bodies, selected by the Accept header
+BINARY_MEDIA_TYPES = ("image/png", "image/webp")
+
+# Largest width or height WebP can store; bigger results are sent as PNG
+WEBP_MAX_SIDE = 16383
+
+# zlib level for PNG responses; 1 is several times faster than the default (6) for ~10% larger files
+PNG_COMPRESS_LEVEL = int(os.environ.get("PNG_COMPRESS_LEVEL", "1"))
+
+# Largest request bodies worth reading: the image (base64 is 4/3 larger) plus form/JSON overhead
+MAX_BODY_BYTES = {
+    "/upscale": MAX_IMAGE_BYTES + 64 * 1024,
+    "/upscale-base64": MAX_IMAGE_BYTES * 4 // 3 + 64 * 1024,
+    "/upscale-base64-raw": MAX_IMAGE_BYTES * 4 // 3 + 64 * 1024,
+}
+
+
+@app.middleware("http")
+async def limit_body_size(request, call_next):
+    """Reject oversized uploads from Content-Length before the body is parsed and spooled"""
+    limit = MAX_BODY_BYTES.get(request.url.path)
+    content_length = request.headers.get("content-length")
+    if limit and content_length and content_length.isdigit() and int(content_length) > limit:
+        return JSONResponse(status_code=413, content={"detail": "File too large. Max size: 2MB"})
+    return await call_next(request)
+
+
+# Added last so it runs first: gzip/deflate bodies are inflated (up to the largest limit)
+# and limit_body_size then checks their decoded Content-Length
+app.add_middleware(DecompressRequestMiddleware, max_bytes=max(MAX_BODY_BYTES.values()))
+
+# CORS middleware, added after the others so it is outermost and their
+# 413/415/400 responses also carry the CORS headers
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
 
 
 @app.get("/")
@@ -78,13 +180,15 @@ async def root():
         "endpoints": {
             "upscale": "/upscale (multipart file upload)",
             "upscale_base64": "/upscale-base64 (JSON with base64)",
+            "upscale_base64_raw": "/upscale-base64-raw (base64 body, parameters in query string)",
             "health": "/health",
             "models": "/models",
             "status": "/status"
         },
         "supported_input_methods": [
             "multipart-form-data (file upload)",
-            "application/json (base64 string)"
+            "application/json (base64 string)",
+            "application/base64 (bare base64 body)"
         ]
     }
 
@@ -113,7 +217,7 @@ async def health_check():
             },
             "supported_scales": [2, 4, 8],
             "max_file_size": "2MB",
-            "input_methods": ["multipart-form-data", "base64-json"],
+            "input_methods": ["multipart-form-data", "base64-json", "base64-raw"],
             "memory_efficient": True
         }
     except Exception as e:
@@ -145,7 +249,8 @@ async def get_available_models():
 async def upscale_image_file(
     file: UploadFile = File(...),
     scale: int = Form(4),
-    model: Optional[str] = Form(None)
+    model: Optional[str] = Form(None),
+    accept: Optional[str] = Header(None)
 ):
     """
     Upscale image using file upload (multipart-form-data)
@@ -154,32 +259,37 @@ async def upscale_image_file(
         file: Image file (jpg, png, webp) - max 2MB
         scale: Upscale factor (2, 4, or 8)
         model: Model to use (optional, auto-selected based on backend)
+        accept: Send "Accept: image/png" or "image/webp" to receive the raw image instead of JSON
     
     Returns:
-        JSON with base64 encoded upscaled image
+        JSON with base64 encoded upscaled image, or the image itself
     """
     
     # Validate inputs
     if scale not in [2, 4, 8]:
         raise HTTPException(status_code=400, detail="Scale must be 2, 4, or 8")
     
-    if file.size and file.size > 2 * 1024 * 1024:  # 2MB limit
-        raise HTTPException(status_code=413, detail="File too large. Max size: 2MB")
-    
     if not file.content_type or not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File must be an image")
     
-    # Read file content
-    content = await file.read()
+    # file.size is None for some clients, so measure the spooled file itself
+    # (which may have rolled over to disk, hence the thread pool)
+    size, header = await asyncio.get_event_loop().run_in_executor(executor, _inspect_upload, file.file)
+    if size > MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail="File too large. Max size: 2MB")
     
-    # Convert to base64 and process
-    image_base64 = base64.b64encode(content).decode('utf-8')
+    # Reject non-images by their signature before handing them to a decoder
+    if not _is_supported_image(header):
+        raise HTTPException(status_code=400, detail="Unsupported image format. Use JPG, PNG or WebP")
     
-    return await _process_upscale(image_base64, scale, model, "auto")
+    # Decode straight from the spooled upload file instead of copying it into bytes
+    return await _process_upscale(file.file, scale, model, "auto", _binary_media_type(accept))
 
 
-@app.post("/upscale-base64", response_model=UpscaleResponse)
-async def upscale_image_base64(request: UpscaleBase64Request):
+# UpscaleResponse documents the schema without response_model validating and
+# re-serializing the multi-MB base64 string through pydantic on every request
+@app.post("/upscale-base64", responses={200: {"model": UpscaleResponse}})
+async def upscale_image_base64(request: UpscaleBase64Request, accept: Optional[str] = Header(None)):
     """
     Upscale image using base64 input (JSON)
     
@@ -195,7 +305,8 @@ async def upscale_image_base64(request: UpscaleBase64Request):
     }
     
     Returns:
-        JSON with base64 encoded upscaled image
+        JSON with base64 encoded upscaled image, or the image itself
+        when the client sends "Accept: image/png" or "Accept: image/webp"
     """
     
     # Validate inputs
@@ -205,57 +316,316 @@ async def upscale_image_base64(request: UpscaleBase64Request):
     if not request.image_base64:
         raise HTTPException(status_code=400, detail="image_base64 is required")
     
-    # Clean base64 string (remove data URL prefix if present)
-    image_base64 = request.image_base64
-    if "," in image_base64:
-        image_base64 = image_base64.split(",")[-1]
+    return await _upscale_base64(request.image_base64, request.scale, request.model, request.format, accept)
+
+
+@app.post("/upscale-base64-raw", responses={200: {"model": UpscaleResponse}})
+async def upscale_image_base64_raw(
+    request: Request,
+    scale: int = 4,
+    model: Optional[str] = None,
+    format: str = "auto",
+    accept: Optional[str] = Header(None),
+    x_image_blake3: Optional[str] = Header(None)
+):
+    """
+    Upscale image sent as a bare base64 request body (Content-Type: application/base64)
+    
+    Same as /upscale-base64 with the parameters in the query string, so the
+    multi-MB string skips JSON encoding on the client and JSON parsing here.
+    With an empty body and an X-Image-Blake3 header (hex blake3 of the decoded
+    image), a cached result is returned without uploading the image, or 404.
+    
+    Returns:
+        Same as /upscale-base64
+    """
+    if scale not in [2, 4, 8]:
+        raise HTTPException(status_code=400, detail="Scale must be 2, 4, or 8")
+    
+    body = await _read_body(request, MAX_BODY_BYTES["/upscale-base64-raw"])
+    if not body:
+        if x_image_blake3:
+            # Without blake3 the cache is keyed on blake2b digests, so no blake3 hash can ever match
+            if DIGEST_NAME != "blake3":
+                raise HTTPException(status_code=501, detail="X-Image-Blake3 lookups need blake3 installed on the server")
+            # Hash-only request: a cached result, or 404 so the client sends the image
+            return await _process_upscale(
+                None, scale, model, format, _binary_media_type(accept), image_digest=x_image_blake3.strip().lower()
+            )
+        raise HTTPException(status_code=400, detail="Request body must be the base64 image")
+    
+    try:
+        image_base64 = body.decode("ascii").strip()
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid base64 image data: not ASCII")
+    del body
+    
+    return await _upscale_base64(image_base64, scale, model, format, accept)
+
+
+async def _read_body(request: Request, limit: int) -> bytearray:
+    """Read the request body, with 413 as soon as it passes limit (chunked bodies skip the Content-Length check)"""
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise HTTPException(status_code=413, detail="File too large. Max size: 2MB")
+    return body
+
+
+async def _upscale_base64(
+    image_base64: str,
+    scale: int,
+    model: Optional[str],
+    output_format: str,
+    accept: Optional[str]
+):
+    """Decode and validate a base64 image (optionally a data URL), then upscale it"""
+    # Clean base64 string (remove data URL prefix if present); the prefix is short,
+    # so only search the head instead of scanning the whole multi-MB string
+    comma = image_base64.find(",", 0, 256)
+    if comma != -1:
+        image_base64 = image_base64[comma + 1:]
+    
+    # Reject oversized payloads from the string length alone, before decoding them
+    if _base64_decoded_size(image_base64) > MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail="Image too large. Max size: 2MB")
     
     # Validate base64
     try:
-        # Test decode
-        image_data = base64.b64decode(image_base64)
-        if len(image_data) > 2 * 1024 * 1024:  # 2MB limit
-            raise HTTPException(status_code=413, detail="Image too large. Max size: 2MB")
+        image_data = await asyncio.get_event_loop().run_in_executor(executor, _decode_base64, image_base64)
         
-        # Try to open as image to validate
-        Image.open(BytesIO(image_data))
+        if not _is_supported_image(image_data[:12]):
+            raise HTTPException(status_code=400, detail="Unsupported image format. Use JPG, PNG or WebP")
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid base64 image data: {str(e)}")
     
     return await _process_upscale(
-        image_base64, 
-        request.scale, 
-        request.model, 
-        request.format
+        BytesIO(image_data), 
+        scale, 
+        model, 
+        output_format,
+        _binary_media_type(accept)
     )
 
 
-async def _process_upscale(image_base64: str, scale: int, model: Optional[str], output_format: str):
-    """Internal function to process upscaling (shared by both endpoints)"""
+def _base64_decoded_size(image_base64: str) -> int:
+    """Decoded size of a base64 string, computed from its length and padding"""
+    return len(image_base64) * 3 // 4 - image_base64[-2:].count("=")
+
+
+def _decode_base64(image_base64: str) -> bytes:
+    """Decode base64 input, leniently if it has line breaks or other non-alphabet characters"""
+    # Strict decoding takes the fast path
+    try:
+        return base64.b64decode(image_base64, validate=True)
+    except binascii.Error:
+        return base64.b64decode(image_base64)
+
+
+def _inspect_upload(image_file: BinaryIO) -> tuple:
+    """Return (size, first 12 bytes) of an upload, leaving it rewound"""
+    image_file.seek(0, os.SEEK_END)
+    size = image_file.tell()
+    image_file.seek(0)
+    header = image_file.read(12)
+    image_file.seek(0)
+    return size, header
+
+
+def _is_supported_image(header: bytes) -> bool:
+    """Check the leading bytes against PNG, JPEG and WebP signatures"""
+    return (
+        header.startswith(b'\x89PNG\r\n\x1a\n')
+        or header.startswith(b'\xff\xd8\xff')
+        or (header[:4] == b'RIFF' and header[8:12] == b'WEBP')
+    )
+
+
+def _binary_media_type(accept: Optional[str]) -> Optional[str]:
+    """
+    Image type the client asked for instead of base64 JSON, if any
+    
+    Only the client's most preferred media range counts (highest q, then first listed),
+    so browser Accept lists that merely include image/webp still get JSON.
+    """
+    if not accept:
+        return None
+    best = None
+    best_q = 0.0
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > best_q:
+            best, best_q = media_type.lower(), q
+    return best if best in BINARY_MEDIA_TYPES else None
+
+
+def _output_media_type(size, media_type: str) -> str:
+    """The requested binary type, or PNG when the image is too large for WebP"""
+    if media_type == "image/webp" and max(size) > WEBP_MAX_SIDE:
+        return "image/png"
+    return media_type
+
+
+def _encode_image(image: Image.Image, media_type: str = "image/png") -> BytesIO:
+    """Encode an upscaled image for the response"""
+    buffer = BytesIO()
+    if media_type == "image/webp":
+        # ~3x smaller than PNG and faster to encode than default-level PNG
+        image.save(buffer, 'WEBP', quality=92, method=4)
+    else:
+        # optimize=True would rerun the compressor for a few % smaller files
+        image.save(buffer, 'PNG', compress_level=PNG_COMPRESS_LEVEL, optimize=False)
+    return buffer
+
+
+def _load_image(image_file: BinaryIO, header_only: bool = False) -> tuple:
+    """
+    Decode the input image into a mode the backends accept
     
-    # Generate unique filename
-    file_id = str(uuid.uuid4())
-    input_path = f"temp/input_{file_id}.png"
-    output_path = f"temp/output_{file_id}.png"
+    Args:
+        image_file: Uploaded image
+        header_only: The caller only needs the size, format and mode of RGB JPEGs
     
+    Returns:
+        tuple: (image, original size, original format, original mode)
+    """
+    # PIL reads lazily from the file object, no intermediate buffer;
+    # this is also the only place the image is parsed, for both endpoints,
+    # and it skips probing the other registered format plugins
     try:
-        # Decode base64 to image
-        image_data = base64.b64decode(image_base64)
-        
-        # Convert to PNG for processing
-        image = Image.open(BytesIO(image_data))
-        original_format = image.format or "UNKNOWN"
-        
-        # Convert modes that might cause issues
-        if image.mode in ('RGBA', 'LA', 'P'):
-            image = image.convert('RGB')
-        
-        # Save as PNG for processing
-        image.save(input_path, 'PNG')
-        
-        # Get memory estimate
-        memory_info = upscaler.get_memory_usage_estimate(image.width, image.height, scale)
+        image = Image.open(image_file, formats=IMAGE_FORMATS)
+        original_size = image.size
+        if header_only and image.format == "JPEG" and image.mode == "RGB":
+            # libjpeg DCT scaling decodes at 1/8 size: the whole stream is still
+            # validated, but most of the IDCT and color conversion work is skipped
+            image.draft("RGB", (max(image.width // 8, 1), max(image.height // 8, 1)))
+        image.load()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image data: {str(e)}")
+    
+    # Backends take 8-bit RGB or grayscale; convert anything else (RGBA, P, CMYK, 16-bit...)
+    # but leave the common RGB/L inputs alone, convert() always copies the pixels
+    original_format, original_mode = image.format or "UNKNOWN", image.mode
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    return image, original_size, original_format, original_mode
+
+
+def _write_ncnn_input(image: Image.Image, image_file: BinaryIO, input_path: str, copy_upload: bool):
+    """Write the upload where the NCNN binary can read it"""
+    if copy_upload:
+        image_file.seek(0)
+        with open(input_path, 'wb') as f:
+            shutil.copyfileobj(image_file, f, 64 * 1024)
+    else:
+        # Decoded right away, so skip most of the deflate work
+        image.save(input_path, 'PNG', compress_level=1)
+
+
+def _read_file(path: str, as_base64: bool) -> bytes:
+    """Read an encoded image file as response bytes, or its base64 encoding for JSON"""
+    if not as_base64:
+        return Path(path).read_bytes()
+    
+    # Encode straight from the mapped file instead of reading it into a bytes object
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return base64.b64encode(mapped)
+
+
+def _read_ncnn_output(output_path: str, media_type: Optional[str]):
+    """Load the NCNN result as response bytes, or its base64 encoding for JSON"""
+    if media_type and media_type != "image/png":
+        with Image.open(output_path) as output_image:
+            return _encode_image(output_image, media_type).getvalue()
+    return _read_file(output_path, as_base64=not media_type)
+
+
+def _store_result(put, *args):
+    """Write a result cache entry; the cache is best-effort, so a failed write is only logged"""
+    try:
+        put(*args)
+    except OSError as e:
+        print(f"⚠️ Result cache write failed: {e}")
+
+
+def _read_buffer(
+    buffer: BytesIO, media_type: Optional[str], cache_key: Optional[str] = None, info: Optional[dict] = None
+) -> bytes:
+    """
+    Take an encoded image as response bytes, or its base64 encoding for JSON, and free the buffer
+    
+    With cache_key the encoded image is also stored in the result cache. Both read the
+    same view, which is released before the buffer is closed.
+    """
+    try:
+        # getbuffer() is a zero-copy view, unlike getvalue()
+        with buffer.getbuffer() as view:
+            if cache_key:
+                _store_result(result_cache.put_bytes, cache_key, view, info)
+            if media_type:
+                return buffer.getvalue()
+            return base64.b64encode(view)
+    finally:
+        buffer.close()
+
+
+def _json_with_image(fields: dict, base64_image: bytes) -> Response:
+    """
+    Render a JSON response whose last field is the base64 image
+    
+    Base64 is already JSON-safe, so the image is spliced between the serialized
+    fields and the closing brace instead of being escaped and copied by the serializer.
+    """
+    head = orjson.dumps(fields) if orjson is not None else json.dumps(fields).encode()
+    body = b"".join((head[:-1], b',"base64_image":"', base64_image, b'"}'))
+    return Response(content=body, media_type="application/json")
+
+
+def _remove_files(*paths: str):
+    """Delete temporary files, ignoring ones that are already gone"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # Already gone, or ignore cleanup errors
+
+
+async def _run_ncnn(
+    image: Image.Image,
+    image_file: BinaryIO,
+    original_mode: str,
+    scale: int,
+    model: Optional[str],
+    media_type: Optional[str],
+    info: dict,
+    cache_key: Optional[str] = None
+):
+    """Upscale through the NCNN binary in a temp file slot, filling in info["upscaled_size"]"""
+    loop = asyncio.get_event_loop()
+    original_format = info["original_format"]
+    
+    slot = await ncnn_slots.get()
+    output_path = f"{slot}_out.png"
+    try:
+        # The NCNN binary reads and writes files. RGB uploads in a format it can
+        # decode are written as-is; anything else is re-encoded as a fast PNG.
+        # Slot inputs are overwritten in place by the next request
+        copy_upload = original_mode == 'RGB' and original_format in NCNN_INPUT_EXTENSIONS
+        extension = NCNN_INPUT_EXTENSIONS[original_format] if copy_upload else "png"
+        input_path = f"{slot}_in.{extension}"
+        await loop.run_in_executor(executor, _write_ncnn_input, image, image_file, input_path, copy_upload)
         
         # Process with Real-ESRGAN
         success = await upscaler.upscale(
@@ -265,21 +635,128 @@ async def _process_upscale(image_base64: str, scale: int, model: Optional[str],
             model=model
         )
         
+        # upscale() already reports whether the output file was created
         if not success:
             raise HTTPException(status_code=500, detail=f"Upscaling failed with {upscaler.active_backend} backend")
         
-        # Verify output exists
-        if not os.path.exists(output_path):
-            raise HTTPException(status_code=500, detail="Output file was not created")
+        # Every NCNN path (native pass, chained x2 or resize) lands exactly on the requested scale
+        width, height = info["original_size"]
+        info["upscaled_size"] = [width * scale, height * scale]
+        if media_type:
+            media_type = info["media_type"] = _output_media_type(info["upscaled_size"], media_type)
+        
+        result = await loop.run_in_executor(executor, _read_ncnn_output, output_path, media_type)
+        if cache_key:
+            if media_type:
+                await loop.run_in_executor(executor, _store_result, result_cache.put_bytes, cache_key, result, info)
+            else:
+                await loop.run_in_executor(executor, _store_result, result_cache.put_file, cache_key, output_path, info)
+        return result
+    finally:
+        # Remove the output so a failed run can never pick up the previous request's result
+        await loop.run_in_executor(executor, _remove_files, output_path)
+        ncnn_slots.put_nowait(slot)
+
+
+async def _run_upscale(
+    image_file: BinaryIO,
+    scale: int,
+    model: Optional[str],
+    media_type: Optional[str],
+    cache_key: Optional[str] = None
+) -> tuple:
+    """
+    Decode, upscale and encode one image, storing the encoded output under cache_key
+    
+    Returns:
+        tuple: (response bytes or base64 text, info dict with sizes and original format)
+    """
+    loop = asyncio.get_event_loop()
+    
+    # Decoding, encoding and file I/O run in the thread pool so concurrent
+    # requests don't serialize on the event loop
+    # RGB JPEGs are handed to NCNN as-is (see _run_ncnn), so their pixels are never used
+    image, original_size, original_format, original_mode = await loop.run_in_executor(
+        executor, _load_image, image_file, upscaler.active_backend == 'ncnn'
+    )
+    info = {"original_format": original_format, "original_size": list(original_size)}
+    
+    if upscaler.active_backend == 'ncnn':
+        result = await _run_ncnn(image, image_file, original_mode, scale, model, media_type, info, cache_key)
+    else:
+        # Python backends upscale the decoded pixels directly, without temp files
+        output_array = await upscaler.upscale_array(np.asarray(image), scale, model)
+        info["upscaled_size"] = [output_array.shape[1], output_array.shape[0]]
+        if media_type:
+            media_type = info["media_type"] = _output_media_type(info["upscaled_size"], media_type)
+        
+        buffer = await loop.run_in_executor(
+            executor, _encode_image, Image.fromarray(output_array), media_type or "image/png"
+        )
+        
+        # Drop each intermediate as soon as the next stage exists, so the raw
+        # pixels, the encoded file and its base64 text are never all held at once
+        del output_array
+        result = await loop.run_in_executor(executor, _read_buffer, buffer, media_type, cache_key, info)
+    
+    return result, info
+
+
+async def _process_upscale(
+    image_file: BinaryIO,
+    scale: int,
+    model: Optional[str],
+    output_format: str,
+    media_type: Optional[str] = None,
+    image_digest: Optional[str] = None
+):
+    """
+    Internal function to process upscaling (shared by all endpoints)
+    
+    image_file may be None when the client sent only image_digest (ResultCache.digest
+    of the image); that request can only be answered from the result cache.
+    """
+    
+    loop = asyncio.get_event_loop()
+    
+    try:
+        # Identical input bytes and parameters give an identical result, skip decoding and inference
+        cache_key = None
+        cached = None
+        if result_cache is not None:
+            if image_digest is None:
+                image_digest = await loop.run_in_executor(executor, result_cache.digest, image_file)
+            cache_key = result_cache.key(image_digest, scale, model, upscaler.active_backend, media_type or "image/png")
+            cached = await loop.run_in_executor(executor, result_cache.get, cache_key)
         
-        # Read result and encode to base64
-        with open(output_path, 'rb') as f:
-            result_bytes = f.read()
+        if cached is not None:
+            cached_path, info = cached
+            result = await loop.run_in_executor(executor, _read_file, cached_path, not media_type)
+        elif image_file is None:
+            raise HTTPException(status_code=404, detail="Image not cached, send it in the request body")
+        else:
+            result, info = await _run_upscale(image_file, scale, model, media_type, cache_key)
         
-        base64_result = base64.b64encode(result_bytes).decode('utf-8')
+        original_format = info["original_format"]
+        original_width, original_height = info["original_size"]
+        output_width, output_height = info["upscaled_size"]
         
-        # Get output image info
-        output_image = Image.open(output_path)
+        if media_type:
+            # Raw image skips the 33% base64 overhead and the large JSON string
+            return Response(
+                content=result,
+                media_type=info.get("media_type", media_type),
+                headers={
+                    "X-Original-Size": f"{original_width}x{original_height}",
+                    "X-Upscaled-Size": f"{output_width}x{output_height}",
+                    "X-Scale-Used": str(scale),
+                    "X-Backend": upscaler.active_backend,
+                    "X-Cache": "HIT" if cached is not None else "MISS"
+                }
+            )
+        
+        # Memory estimate is only reported in the JSON body
+        memory_info = upscaler.get_memory_usage_estimate(original_width, original_height, scale)
         
         # Determine output format
         final_format = "PNG"
@@ -289,10 +766,10 @@ async def _process_upscale(image_base64: str, scale: int, model: Optional[str],
         elif output_format.upper() in ["JPEG", "JPG"]:
             final_format = "JPEG"
         
-        return {
+        return _json_with_image({
             "success": True,
-            "original_size": f"{image.width}x{image.height}",
-            "upscaled_size": f"{output_image.width}x{output_image.height}",
+            "original_size": f"{original_width}x{original_height}",
+            "upscaled_size": f"{output_width}x{output_height}",
             "scale_used": scale,
             "model_used": model or f"{upscaler.active_backend}-default",
             "backend": upscaler.active_backend,
@@ -303,10 +780,10 @@ async def _process_upscale(image_base64: str, scale: int, model: Optional[str],
                 "backend": upscaler.active_backend,
                 "tile_size": memory_info.get("recommended_tile_size"),
                 "quality_level": memory_info.get("quality"),
-                "original_format": original_format
-            },
-            "base64_image": base64_result
-        }
+                "original_format": original_format,
+                "cache_hit": cached is not None
+            }
+        }, result)
         
     except HTTPException:
         # Re-raise HTTP exceptions as-is
@@ -316,15 +793,6 @@ async def _process_upscale(image_base64: str, scale: int, model: Optional[str],
         if "Real-ESRGAN" in error_msg:
             error_msg += f" (Using {upscaler.active_backend} backend)"
         raise HTTPException(status_code=500, detail=f"Processing error: {error_msg}")
-    
-    finally:
-        # Cleanup temporary files
-        for path in [input_path, output_path]:
-            if os.path.exists(path):
-                try:
-                    os.remove(path)
-                except:
-                    pass  # Ignore cleanup errors
 
 
 @app.get("/status")
@@ -0,0 +1,280 @@
+"""
+NCNN Runner Module
+Runs the realesrgan-ncnn-vulkan binary for the NCNN and hybrid upscalers
+"""
+
+import os
+import asyncio
+import shutil
+import subprocess
+from collections import deque
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+
+from PIL import Image
+
+from app.batching import BatchScheduler
+
+try:
+    import pyvips
+except ImportError:
+    pyvips = None
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# Coalescing window and size for concurrent NCNN passes; a process start costs far more than the wait
+NCNN_BATCH_SIZE = int(os.environ.get("NCNN_BATCH_SIZE", "8"))
+NCNN_BATCH_WAIT_MS = float(os.environ.get("NCNN_BATCH_WAIT_MS", "50"))
+
+# stderr lines kept from a NCNN run for its error message
+NCNN_STDERR_LINES = 20
+
+# INT8 models ("<model>-int8.bin/.param" from ncnn2int8) replace FP32 ones when the CPU has
+# VNNI int8 dot products; NCNN_INT8=1 always prefers them, NCNN_INT8=0 never does
+NCNN_INT8 = os.environ.get("NCNN_INT8", "auto")
+
+
+def _cpu_has_vnni() -> bool:
+    """Whether the CPU advertises AVX-512 VNNI or AVX-VNNI (read from /proc/cpuinfo)"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_vnni" in flags or "avx_vnni" in flags
+
+
+class NcnnRunner:
+    """realesrgan-ncnn-vulkan passes over image files, with concurrent passes batched into one process"""
+    
+    def __init__(self, binary_path: str = "bin/realesrgan-ncnn-vulkan", models_path: str = "models"):
+        self.binary_path = Path(binary_path)
+        self.models_path = Path(models_path)
+        
+        # Available models mapping
+        self.model_mapping = {
+            "realesrgan-x4plus": "realesrgan-x4plus",
+            "realesrgan-x4plus-anime": "realesrgan-x4plus-anime", 
+            "realesr-animevideov3": "realesr-animevideov3-x4",
+            "realesrnet-x4plus": "realesrnet-x4plus"
+        }
+        
+        # Installed NCNN models, scanned once instead of stat-ing model files per request
+        self.installed_models = self._scan_models()
+        self.use_int8 = NCNN_INT8 == "1" or (NCNN_INT8 == "auto" and _cpu_has_vnni())
+        
+        # Concurrent NCNN passes with the same settings run as one process over a directory
+        self.scheduler = BatchScheduler(
+            self._run_binary_batch,
+            max_batch_size=NCNN_BATCH_SIZE,
+            max_wait_ms=NCNN_BATCH_WAIT_MS,
+            bucket_key=lambda job: job[2:]
+        )
+    
+    def check_binary(self) -> bool:
+        """Check if Real-ESRGAN binary exists and is executable"""
+        return self.binary_path.exists() and os.access(self.binary_path, os.X_OK)
+    
+    def _scan_models(self) -> set:
+        """Names of the models with both .bin and .param files in models_path"""
+        if not self.models_path.exists():
+            return set()
+        return {p.stem for p in self.models_path.glob("*.bin") if p.with_suffix(".param").exists()}
+    
+    def reload_models(self):
+        """Rescan models_path after model files are added or removed at runtime"""
+        self.installed_models = self._scan_models()
+    
+    def list_models(self) -> List[str]:
+        """List available models"""
+        return [name for name, file_name in self.model_mapping.items() if file_name in self.installed_models]
+    
+    async def upscale(
+        self,
+        input_path: str,
+        output_path: str,
+        scale: int = 4,
+        model: Optional[str] = "realesrgan-x4plus",
+        tile_size: int = 512
+    ) -> bool:
+        """
+        Upscale an image file, chaining passes or resizing for scales the model lacks
+        
+        Args:
+            input_path: Path to input image
+            output_path: Path for output image
+            scale: Scale factor (2, 4, or 8)
+            model: Model name to use
+            tile_size: Tile size for processing (lower = less memory)
+        
+        Returns:
+            bool: Success status
+        """
+        
+        # Validate model
+        if model not in self.model_mapping:
+            model = "realesrgan-x4plus"  # Default fallback
+        
+        model_name = self.model_mapping[model]
+        
+        # Check if model files exist
+        if model_name not in self.installed_models:
+            raise Exception(f"Model files not found for {model}")
+        
+        # A native 2x model (e.g. realesr-animevideov3-x2) avoids running 4x and downscaling
+        model_x2 = self._scaled_model_name(model_name, 2)
+        model_name, model_x2 = self._int8_model_name(model_name), self._int8_model_name(model_x2)
+        
+        try:
+            if scale == 2 and model_x2:
+                await self._run_binary(input_path, output_path, 2, model_x2, tile_size)
+            elif scale in (2, 8):
+                # Use the 4x model first
+                temp_output = output_path.replace('.png', '_temp.png')
+                try:
+                    await self._run_binary(input_path, temp_output, 4, model_name, tile_size)
+                    if scale == 8 and model_x2:
+                        # Chain a 2x pass through the binary instead of a PIL resize
+                        await self._run_binary(temp_output, output_path, 2, model_x2, tile_size)
+                    else:
+                        await self._resize_image(temp_output, output_path, scale / 4)
+                finally:
+                    # Clean up temp file
+                    try:
+                        os.remove(temp_output)
+                    except FileNotFoundError:
+                        pass
+            else:
+                await self._run_binary(input_path, output_path, scale, model_name, tile_size)
+            
+            # _run_binary raises when NCNN fails, so the output is in place
+            return True
+            
+        except Exception as e:
+            raise Exception(f"Upscaling failed: {str(e)}")
+    
+    def _scaled_model_name(self, model_name: str, scale: int) -> Optional[str]:
+        """Name of the same model family at another scale, if its files are installed"""
+        if not model_name.endswith("-x4"):
+            return None
+        
+        candidate = f"{model_name[:-3]}-x{scale}"
+        return candidate if candidate in self.installed_models else None
+    
+    def _int8_model_name(self, model_name: Optional[str]) -> Optional[str]:
+        """INT8 variant of a model if enabled and installed, otherwise the model itself"""
+        if model_name and self.use_int8 and f"{model_name}-int8" in self.installed_models:
+            return f"{model_name}-int8"
+        return model_name
+    
+    async def _run_binary(self, input_path: str, output_path: str, scale: int, model_name: str, tile_size: int):
+        """Run one NCNN-Vulkan pass, raising if the process fails"""
+        # Concurrent passes with the same settings share one process (see _run_binary_batch)
+        await self.scheduler.submit((input_path, output_path, scale, model_name, tile_size))
+    
+    def _run_binary_batch(self, jobs: list) -> list:
+        """
+        Run NCNN-Vulkan once for a batch of (input, output, scale, model, tile) jobs
+        
+        The binary has no daemon mode, so every invocation pays for loading the
+        model and initializing Vulkan. Feeding it a directory of inputs pays that
+        once per batch instead of once per request.
+        
+        Returns:
+            list: None for each job whose output is in place, or the exception for one that failed
+        """
+        _, _, scale, model_name, tile_size = jobs[0]
+        work_dir = None
+        
+        if len(jobs) == 1:
+            input_arg, output_arg = jobs[0][0], jobs[0][1]
+        else:
+            # Work directory next to the outputs so results can be renamed into place
+            work_dir = tempfile.mkdtemp(dir=os.path.dirname(jobs[0][1]) or ".")
+            input_arg = os.path.join(work_dir, "in")
+            output_arg = os.path.join(work_dir, "out")
+            os.mkdir(input_arg)
+            os.mkdir(output_arg)
+            for i, (input_path, *_) in enumerate(jobs):
+                batch_input = os.path.join(input_arg, f"{i}{Path(input_path).suffix}")
+                try:
+                    os.link(input_path, batch_input)
+                except OSError:
+                    shutil.copyfile(input_path, batch_input)
+        
+        try:
+            # Build command for Real-ESRGAN NCNN-Vulkan
+            cmd = [
+                str(self.binary_path),
+                "-i", input_arg,
+                "-o", output_arg,
+                "-s", str(scale),
+                "-t", str(tile_size),
+                "-m", str(self.models_path),
+                "-n", model_name,
+                "-j", "1:2:1",  # Low memory configuration: 1 load thread, 2 proc threads, 1 save thread
+                "-f", "png"     # Force PNG output
+            ]
+            
+            # Run Real-ESRGAN process (blocking is fine, this runs on the scheduler's worker thread).
+            # Its per-tile progress on stderr is consumed as it arrives, keeping only the last
+            # non-progress lines for error messages instead of buffering everything until exit
+            process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            stderr_tail = deque(maxlen=NCNN_STDERR_LINES)
+            for line in process.stderr:
+                line = line.decode(errors='replace').rstrip()
+                if not line.endswith('%'):
+                    stderr_tail.append(line)
+            
+            if process.wait() != 0:
+                error_msg = "\n".join(stderr_tail) or "Unknown error"
+                raise Exception(f"Real-ESRGAN process failed: {error_msg}")
+            
+            if not work_dir:
+                return [None]
+            
+            # Directory mode names each output after its input, with the -f extension;
+            # a missing one fails only its own job
+            results = []
+            for i, (_, output_path, *_) in enumerate(jobs):
+                try:
+                    os.replace(os.path.join(output_arg, f"{i}.png"), output_path)
+                    results.append(None)
+                except OSError as e:
+                    results.append(Exception(f"Real-ESRGAN produced no output: {e}"))
+            return results
+        finally:
+            if work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    
+    async def _resize_image(self, input_path: str, output_path: str, scale_factor: float):
+        """Resize image for 2x/8x scaling, with libvips when available and PIL otherwise"""
+        await asyncio.get_event_loop().run_in_executor(None, self._resize_image_sync, input_path, output_path, scale_factor)
+    
+    def _resize_image_sync(self, input_path: str, output_path: str, scale_factor: float):
+        """Blocking part of _resize_image"""
+        if pyvips is not None:
+            # Streams the image through a SIMD Lanczos kernel without decoding it all at once
+            image = pyvips.Image.new_from_file(input_path, access='sequential')
+            image.resize(scale_factor, kernel='lanczos3').write_to_file(output_path, compression=1)
+            return
+        
+        if cv2 is not None:
+            # One vectorized pass; INTER_AREA averages whole source pixels, the right filter for a shrink
+            img = cv2.imread(input_path, cv2.IMREAD_UNCHANGED)
+            size = (int(img.shape[1] * scale_factor), int(img.shape[0] * scale_factor))
+            interpolation = cv2.INTER_AREA if scale_factor < 1 else cv2.INTER_LANCZOS4
+            cv2.imwrite(output_path, cv2.resize(img, size, interpolation=interpolation), [cv2.IMWRITE_PNG_COMPRESSION, 1])
+            return
+        
+        with Image.open(input_path) as img:
+            new_width = int(img.width * scale_factor)
+            new_height = int(img.height * scale_factor)
+            
+            # Use high-quality resampling
+            resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+            resized.save(output_path, 'PNG', compress_level=1)
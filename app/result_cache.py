@@ -0,0 +1,115 @@
+"""
+Result Cache Module
+Disk cache of encoded upscale results keyed by a hash of the input bytes and parameters
+"""
+
+import os
+import json
+import shutil
+import threading
+import hashlib
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+# blake3 hashes several GB/s with SIMD; blake2b is the stdlib fallback
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
+# Algorithm behind ResultCache.digest, for clients that send a precomputed hash
+DIGEST_NAME = "blake3" if blake3 is not None else "blake2b"
+
+
+class ResultCache:
+    """LRU (by mtime) disk cache of encoded outputs with a total size cap"""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def digest(self, image_file: BinaryIO) -> str:
+        """Hash the input file contents (hex blake3, or blake2b if blake3 is not installed)"""
+        digest = blake3() if blake3 is not None else hashlib.blake2b()
+        image_file.seek(0)
+        for chunk in iter(lambda: image_file.read(64 * 1024), b''):
+            digest.update(chunk)
+        image_file.seek(0)
+        return digest.hexdigest()
+
+    def key(self, image_digest: str, *params) -> str:
+        """Cache key for an input digest (see digest()) together with the request parameters"""
+        return hashlib.blake2b("|".join([image_digest, *map(str, params)]).encode(), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[tuple]:
+        """
+        Look up a cached result
+
+        Returns:
+            tuple: (path of the encoded output, metadata dict) or None on a miss
+        """
+        data_path = self.cache_dir / f"{key}.bin"
+        try:
+            meta = json.loads((self.cache_dir / f"{key}.json").read_text())
+            # Refresh mtime so eviction drops the least recently used entries first
+            os.utime(data_path)
+        except (OSError, ValueError):
+            return None
+        return str(data_path), meta
+
+    def put_bytes(self, key: str, data, meta: dict):
+        """Store an encoded output held in memory"""
+        tmp_path = self._tmp_path(key)
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            self._commit(key, tmp_path, meta)
+        except OSError:
+            # Don't leave a partial write behind (e.g. on a full disk)
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def put_file(self, key: str, path: str, meta: dict):
+        """Store an encoded output file, hard-linking it when on the same filesystem"""
+        tmp_path = self._tmp_path(key)
+        try:
+            try:
+                os.link(path, tmp_path)
+            except OSError:
+                shutil.copyfile(path, tmp_path)
+            self._commit(key, tmp_path, meta)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def _tmp_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def _commit(self, key: str, tmp_path: Path, meta: dict):
+        """Move a written entry into place (data first, so a visible .json always has its data) and evict"""
+        os.replace(tmp_path, self.cache_dir / f"{key}.bin")
+        (self.cache_dir / f"{key}.json").write_text(json.dumps(meta))
+        self._evict()
+
+    def _evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for data_path in self.cache_dir.glob("*.bin"):
+            try:
+                stat = data_path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, data_path))
+            total += stat.st_size
+
+        for _, size, data_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for path in (data_path.with_suffix(".json"), data_path):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            total -= size
@@ -0,0 +1,177 @@
+"""
+TensorRT Inference Module
+Runs a prebuilt Real-ESRGAN TensorRT engine as a drop-in for the PyTorch model
+"""
+
+import math
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Optional
+
+import torch
+import torch.nn.functional as F
+
+try:
+    import tensorrt as trt
+except ImportError:
+    trt = None
+
+
+# Engines and ONNX exports are stored per weights file, e.g. models/RealESRGAN_x4plus.plan, built with:
+#   trtexec --onnx=models/RealESRGAN_x4plus.onnx --fp16 --saveEngine=models/RealESRGAN_x4plus.plan \
+#       --minShapes=input:1x3x64x64 --optShapes=input:4x3x400x400 --maxShapes=input:8x3x512x512
+TRT_ENGINE_DIR = os.environ.get("TRT_ENGINE_DIR", "models")
+TRT_MIN_SHAPE = os.environ.get("TRT_MIN_SHAPE", "1x3x64x64")
+TRT_OPT_SHAPE = os.environ.get("TRT_OPT_SHAPE", "4x3x400x400")
+TRT_MAX_SHAPE = os.environ.get("TRT_MAX_SHAPE", "8x3x512x512")
+
+
+class TensorRTModel:
+    """TensorRT engine (fixed or dynamic shape) that can replace RealESRGANer.model"""
+
+    def __init__(self, engine_path: str, scale: int, fallback: torch.nn.Module):
+        self.scale = scale
+        self.fallback = fallback
+
+        logger = trt.Logger(trt.Logger.WARNING)
+        self.runtime = trt.Runtime(logger)
+        self.engine = self.runtime.deserialize_cuda_engine(Path(engine_path).read_bytes())
+        if self.engine is None:
+            raise RuntimeError(f"Failed to deserialize TensorRT engine: {engine_path}")
+        self.context = self.engine.create_execution_context()
+
+        self.input_name = self.engine.get_tensor_name(0)
+        self.output_name = self.engine.get_tensor_name(1)
+        input_shape = tuple(self.engine.get_tensor_shape(self.input_name))
+        dtype = torch.float16 if self.engine.get_tensor_dtype(self.input_name) == trt.DataType.HALF else torch.float32
+
+        # Dynamic engines accept any shape in optimization profile 0; buffers are sized for its max
+        self.dynamic = -1 in input_shape
+        if self.dynamic:
+            min_shape, _, max_shape = self.engine.get_tensor_profile_shape(self.input_name, 0)
+            self.min_shape, input_shape = tuple(min_shape), tuple(max_shape)
+        else:
+            self.min_shape = input_shape
+        # Largest square tile the engine runs without falling back to PyTorch
+        self.max_side = min(input_shape[2], input_shape[3])
+        output_shape = input_shape[:2] + (input_shape[2] * scale, input_shape[3] * scale)
+
+        # Persistent device buffers and stream, bound once
+        self.input = torch.empty(input_shape, dtype=dtype, device="cuda")
+        self.output = torch.empty(output_shape, dtype=dtype, device="cuda")
+        self.context.set_tensor_address(self.input_name, self.input.data_ptr())
+        self.context.set_tensor_address(self.output_name, self.output.data_ptr())
+        self.stream = torch.cuda.Stream()
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        """Run a (batch, 3, h, w) stack of tiles, padding them up to a shape the engine accepts"""
+        batch, channels, height, width = x.shape
+        max_batch, _, max_height, max_width = self.input.shape
+        min_batch, _, min_height, min_width = self.min_shape
+
+        # Tiles outside the engine's shape range go through PyTorch
+        if height > max_height or width > max_width:
+            return self.fallback(x)
+        # Stacks larger than the engine's max batch run in engine-sized chunks
+        if batch > max_batch:
+            return torch.cat([self(x[i:i + max_batch]) for i in range(0, batch, max_batch)])
+        if batch < min_batch:
+            return self.fallback(x)
+
+        if self.dynamic:
+            padded_height, padded_width = max(height, min_height), max(width, min_width)
+            shape = (batch, channels, padded_height, padded_width)
+            self.context.set_input_shape(self.input_name, shape)
+        else:
+            padded_height, padded_width = max_height, max_width
+            shape = tuple(self.input.shape)
+
+        # Views over the start of the bound buffers keep their addresses valid
+        engine_input = self.input.view(-1)[:math.prod(shape)].view(shape)
+        output_shape = (batch, channels, padded_height * self.scale, padded_width * self.scale)
+        engine_output = self.output.view(-1)[:math.prod(output_shape)].view(output_shape)
+
+        padded = F.pad(x, (0, padded_width - width, 0, padded_height - height), mode="replicate")
+        engine_input.copy_(padded)
+
+        current = torch.cuda.current_stream()
+        self.stream.wait_stream(current)
+        self.context.execute_async_v3(self.stream.cuda_stream)
+        current.wait_stream(self.stream)
+
+        return engine_output[:, :, :height * self.scale, :width * self.scale].to(x.dtype).clone()
+
+
+def export_onnx(model: torch.nn.Module, onnx_path: str) -> bool:
+    """Export the network to ONNX with dynamic batch and spatial axes"""
+    param = next(model.parameters())
+    dummy = torch.randn(1, 3, 64, 64, dtype=param.dtype, device=param.device)
+    dynamic_axes = {"input": {0: "batch", 2: "height", 3: "width"}, "output": {0: "batch", 2: "height", 3: "width"}}
+
+    try:
+        Path(onnx_path).parent.mkdir(parents=True, exist_ok=True)
+        with torch.inference_mode():
+            torch.onnx.export(
+                model, dummy, onnx_path,
+                opset_version=17,
+                input_names=["input"],
+                output_names=["output"],
+                dynamic_axes=dynamic_axes
+            )
+    except Exception as e:
+        print(f"ONNX export failed: {e}")
+        return False
+    return True
+
+
+def build_engine(onnx_path: str, engine_path: str, model: Optional[torch.nn.Module] = None) -> bool:
+    """Build an FP16 engine from an ONNX export with trtexec (cached on disk), exporting model first if needed"""
+    trtexec = shutil.which("trtexec")
+    if trtexec is None:
+        return False
+    if not Path(onnx_path).exists() and (model is None or not export_onnx(model, onnx_path)):
+        return False
+
+    result = subprocess.run(
+        [
+            trtexec,
+            f"--onnx={onnx_path}",
+            "--fp16",
+            f"--saveEngine={engine_path}",
+            f"--minShapes=input:{TRT_MIN_SHAPE}",
+            f"--optShapes=input:{TRT_OPT_SHAPE}",
+            f"--maxShapes=input:{TRT_MAX_SHAPE}"
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        print(f"TensorRT engine build failed: {result.stderr.decode(errors='replace')[-500:]}")
+        return False
+    return Path(engine_path).exists()
+
+
+def load_trt_model(model: torch.nn.Module, scale: int, model_name: str) -> Optional[TensorRTModel]:
+    """
+    Wrap model with a TensorRT engine if TensorRT and CUDA are available, building the engine on first use
+
+    Args:
+        model: PyTorch network, exported to ONNX if no engine exists and used as fallback
+        scale: Network upscale factor
+        model_name: Weights name (e.g. RealESRGAN_x4plus) the engine and ONNX files are named after
+    """
+    if trt is None or not torch.cuda.is_available():
+        return None
+
+    engine_path = str(Path(TRT_ENGINE_DIR) / f"{model_name}.plan")
+    onnx_path = str(Path(TRT_ENGINE_DIR) / f"{model_name}.onnx")
+    if not Path(engine_path).exists() and not build_engine(onnx_path, engine_path, model=model):
+        return None
+
+    try:
+        return TensorRTModel(engine_path, scale, fallback=model)
+    except Exception as e:
+        print(f"TensorRT engine unavailable, using PyTorch: {e}")
+        return None
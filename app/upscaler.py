@@ -3,59 +3,44 @@ Real-ESRGAN Upscaler Module
 Handles the NCNN-Vulkan backend for image upscaling
 """
 
-import os
-import asyncio
-import subprocess
 from pathlib import Path
 from typing import List, Optional
 
+from app.ncnn_runner import NcnnRunner
+
 
 class RealESRGANUpscaler:
     """Real-ESRGAN upscaler using NCNN-Vulkan backend"""
     
     def __init__(self):
-        self.binary_path = Path("bin/realesrgan-ncnn-vulkan")
-        self.models_path = Path("models")
         self.temp_path = Path("temp")
         
         # Ensure directories exist
         self.temp_path.mkdir(exist_ok=True)
         
-        # Available models mapping
-        self.model_mapping = {
-            "realesrgan-x4plus": "realesrgan-x4plus",
-            "realesrgan-x4plus-anime": "realesrgan-x4plus-anime", 
-            "realesr-animevideov3": "realesr-animevideov3-x4",
-            "realesrnet-x4plus": "realesrnet-x4plus"
-        }
+        # Binary, installed models and batching of concurrent passes
+        self.ncnn = NcnnRunner()
+        
+        # Backend info in the same shape as the other upscaler modules
+        self.backends = {'ncnn': {'available': self.ncnn.check_binary()}}
+        self.active_backend = 'ncnn' if self.backends['ncnn']['available'] else 'none'
     
     def check_binary(self) -> bool:
         """Check if Real-ESRGAN binary exists and is executable"""
-        return self.binary_path.exists() and os.access(self.binary_path, os.X_OK)
+        return self.ncnn.check_binary()
+    
+    def reload_models(self):
+        """Rescan the models directory after model files are added or removed at runtime"""
+        self.ncnn.reload_models()
     
     def check_models(self) -> bool:
         """Check if model files exist"""
-        if not self.models_path.exists():
-            return False
-        
         # Check for at least one complete model (bin + param files)
-        model_files = list(self.models_path.glob("*.bin"))
-        return len(model_files) > 0
+        return len(self.ncnn.installed_models) > 0
     
     def list_models(self) -> List[str]:
         """List available models"""
-        if not self.models_path.exists():
-            return []
-        
-        available_models = []
-        for model_name in self.model_mapping.keys():
-            bin_file = self.models_path / f"{self.model_mapping[model_name]}.bin"
-            param_file = self.models_path / f"{self.model_mapping[model_name]}.param"
-            
-            if bin_file.exists() and param_file.exists():
-                available_models.append(model_name)
-        
-        return available_models
+        return self.ncnn.list_models()
     
     async def upscale(
         self,
@@ -79,90 +64,10 @@ class RealESRGANUpscaler:
             bool: Success status
         """
         
-        if not self.check_binary():
+        if not self.backends['ncnn']['available']:
             raise Exception("Real-ESRGAN binary not found or not executable")
         
-        # Validate model
-        if model not in self.model_mapping:
-            model = "realesrgan-x4plus"  # Default fallback
-        
-        model_name = self.model_mapping[model]
-        
-        # Check if model files exist
-        bin_file = self.models_path / f"{model_name}.bin"
-        param_file = self.models_path / f"{model_name}.param"
-        
-        if not (bin_file.exists() and param_file.exists()):
-            raise Exception(f"Model files not found for {model}")
-        
-        # Handle different scales
-        if scale == 2:
-            # Use 4x model and resize down
-            actual_scale = 4
-            resize_after = True
-            final_scale = 2
-        elif scale == 8:
-            # Use 4x model and resize up  
-            actual_scale = 4
-            resize_after = True
-            final_scale = 8
-        else:
-            actual_scale = scale
-            resize_after = False
-            final_scale = scale
-        
-        # Build command for Real-ESRGAN NCNN-Vulkan
-        cmd = [
-            str(self.binary_path),
-            "-i", input_path,
-            "-o", output_path if not resize_after else output_path.replace('.png', '_temp.png'),
-            "-s", str(actual_scale),
-            "-t", str(tile_size),
-            "-m", str(self.models_path),
-            "-n", model_name,
-            "-j", "1:2:1",  # Low memory configuration: 1 load thread, 2 proc threads, 1 save thread
-            "-f", "png"     # Force PNG output
-        ]
-        
-        try:
-            # Run Real-ESRGAN process
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode != 0:
-                error_msg = stderr.decode() if stderr else "Unknown error"
-                raise Exception(f"Real-ESRGAN process failed: {error_msg}")
-            
-            # Handle post-processing for 2x and 8x scales
-            if resize_after:
-                temp_output = output_path.replace('.png', '_temp.png')
-                await self._resize_image(temp_output, output_path, final_scale / actual_scale)
-                # Clean up temp file
-                if os.path.exists(temp_output):
-                    os.remove(temp_output)
-            
-            # Verify output file exists
-            return os.path.exists(output_path)
-            
-        except Exception as e:
-            raise Exception(f"Upscaling failed: {str(e)}")
-    
-    async def _resize_image(self, input_path: str, output_path: str, scale_factor: float):
-        """Resize image using PIL for 2x/8x scaling"""
-        from PIL import Image
-        
-        with Image.open(input_path) as img:
-            new_width = int(img.width * scale_factor)
-            new_height = int(img.height * scale_factor)
-            
-            # Use high-quality resampling
-            resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            resized.save(output_path, 'PNG')
+        return await self.ncnn.upscale(input_path, output_path, scale, model, tile_size)
     
     def get_memory_usage_estimate(self, image_width: int, image_height: int, scale: int) -> dict:
         """Estimate memory usage for processing"""
@@ -182,5 +87,7 @@ class RealESRGANUpscaler:
             "base_memory_mb": base_memory_mb,
             "processing_memory_mb": round(processing_memory_mb, 1),
             "total_estimated_mb": round(total_memory_mb, 1),
-            "recommended_tile_size": 512 if total_memory_mb > 2000 else 0
+            "backend": self.active_backend,
+            "recommended_tile_size": 512 if total_memory_mb > 2000 else 0,
+            "quality": "high"
         }
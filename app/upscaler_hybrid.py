@@ -3,85 +3,183 @@ Real-ESRGAN Upscaler Module
 Handles both NCNN-Vulkan backend and Python fallback for image upscaling
 """
 
-import os
 import asyncio
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Optional
-import tempfile
+
+from app.batching import BatchScheduler
+from app.ncnn_runner import NcnnRunner
+
+# OpenCV for the Python path; imported once here, not per request
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+
+# Persistent thread that owns the Python model: it loads it and runs every batch,
+# so CUDA state and the caching allocator stay on one OS thread
+gpu_executor = ThreadPoolExecutor(max_workers=1)
 
 
 class RealESRGANUpscaler:
     """Real-ESRGAN upscaler with NCNN-Vulkan backend and Python fallback"""
     
     def __init__(self):
-        self.binary_path = Path("bin/realesrgan-ncnn-vulkan")
-        self.models_path = Path("models")
         self.temp_path = Path("temp")
         
+        # Binary, installed models and batching of concurrent NCNN passes
+        self.ncnn = NcnnRunner()
+        
         # Check if we have NCNN binary or should use Python version
         self.use_python_version = not self.check_binary()
         
         # Ensure directories exist
         self.temp_path.mkdir(exist_ok=True)
         
-        # Available models mapping
-        self.model_mapping = {
-            "realesrgan-x4plus": "realesrgan-x4plus",
-            "realesrgan-x4plus-anime": "realesrgan-x4plus-anime", 
-            "realesr-animevideov3": "realesr-animevideov3-x4",
-            "realesrnet-x4plus": "realesrnet-x4plus"
-        }
-        
         # Initialize Python version if needed
+        self.python_available = False
+        self.python_load_lock = asyncio.Lock()
         if self.use_python_version:
             self._init_python_version()
+        
+        # Backend info in the same shape as the other upscaler modules
+        self.backends = {
+            'realesrgan': {'available': self.python_available},
+            'ncnn': {'available': not self.use_python_version}
+        }
+        if not self.use_python_version:
+            self.active_backend = 'ncnn'
+        elif self.python_available:
+            self.active_backend = 'realesrgan'
+        else:
+            self.active_backend = 'none'
+
     
     def _init_python_version(self):
         """Initialize Python-based Real-ESRGAN"""
         try:
             global RealESRGANer, RRDBNet
-            from realesrgan import RealESRGANer
-            from realesrgan.archs.rrdbnet_arch import RRDBNet
+            from app.fast_realesrgan import FastRealESRGANer as RealESRGANer
+            from basicsr.archs.rrdbnet_arch import RRDBNet
             self.python_available = True
             self.python_upscaler = None
         except ImportError:
             self.python_available = False
             print("Warning: Python Real-ESRGAN not available, API will have limited functionality")
     
+    async def preload(self):
+        """
+        Load and warm up the default model so the first request doesn't pay the download/compile latency
+        
+        Run from the app's startup hook, not __init__: the GPU thread must start in the
+        serving process, a thread started before a fork is dead in the child.
+        """
+        if not self.use_python_version or not self.python_available:
+            return
+        try:
+            await self._ensure_python_upscaler(None)
+        except Exception as e:
+            self.python_upscaler = None
+            print(f"Warning: Real-ESRGAN model preload failed, will retry on first request: {e}")
+    
+    def _load_python_upscaler(self, model: str):
+        """Create the cached RealESRGANer instance for the given model"""
+        # Select model based on request
+        if "anime" in model.lower():
+            model_name = "RealESRGAN_x4plus_anime_6B"
+            netscale = 4
+        else:
+            model_name = "RealESRGAN_x4plus"
+            netscale = 4
+        
+        # Create model
+        model_net = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=netscale)
+        
+        # Initialize upscaler
+        import torch
+        from app.fast_realesrgan import select_tile_settings
+        from app.weights import ensure_weights
+        tile, tile_pad = select_tile_settings()
+        self.python_upscaler = RealESRGANer(
+            scale=netscale,
+            model_path=ensure_weights(model_name),
+            model=model_net,
+            tile=tile,  # Use tiling for memory efficiency
+            tile_pad=tile_pad,
+            pre_pad=0,
+            half=torch.cuda.is_available()  # Half precision on CUDA only; CPU conv kernels don't support Half
+        )
+        
+        self._optimize_python_model(model_name)
+        
+        # Batch concurrent (image, scale, rgb) requests with the same size, scale and channel
+        # order into a single forward pass, uploading the next batch while the current one runs
+        self.batch_scheduler = BatchScheduler(
+            lambda prepared: self.python_upscaler.run_batch(*prepared),
+            max_batch_size=4,
+            max_wait_ms=10,
+            bucket_key=lambda item: (item[0].shape,) + item[1:],
+            prepare_batch=lambda items: (
+                self.python_upscaler.upload([img for img, _, _ in items], items[0][2]),
+            ) + items[0][1:],
+            executor=gpu_executor
+        )
+    
+    def _optimize_python_model(self, model_name: str):
+        """Swap in a TensorRT engine for model_name's weights, or compile with torch.compile (CUDA only)"""
+        import torch
+        
+        if not torch.cuda.is_available():
+            return
+        
+        # Prefer a prebuilt TensorRT engine; the PyTorch model stays as fallback
+        from app.trt_upscaler import load_trt_model
+        upscaler = self.python_upscaler
+        trt_model = load_trt_model(upscaler.model, upscaler.scale, model_name)
+        if trt_model is not None:
+            upscaler.model = trt_model
+            # Keep every pass inside the engine's shape range: padded tiles no larger than
+            # its max side, and small images as a single tile instead of one whole-image pass
+            upscaler.tile_size = min(upscaler.tile_size, trt_model.max_side - 2 * upscaler.tile_pad)
+            upscaler.one_pass = False
+            print(f"✅ TensorRT engine loaded (tile size {upscaler.tile_size})")
+            return
+        
+        from app.fast_realesrgan import compile_model
+        compile_model(self.python_upscaler)
+    
+    async def _ensure_python_upscaler(self, model: Optional[str]):
+        """Load the Python model on the GPU thread if the startup preload failed, without blocking the loop"""
+        async with self.python_load_lock:
+            if self.python_upscaler is None:
+                await asyncio.get_event_loop().run_in_executor(
+                    gpu_executor, self._load_python_upscaler, model or "realesrgan-x4plus"
+                )
+    
     def check_binary(self) -> bool:
         """Check if Real-ESRGAN binary exists and is executable"""
-        return self.binary_path.exists() and os.access(self.binary_path, os.X_OK)
+        return self.ncnn.check_binary()
+    
+    def reload_models(self):
+        """Rescan the models directory after model files are added or removed at runtime"""
+        self.ncnn.reload_models()
     
     def check_models(self) -> bool:
         """Check if model files exist"""
         if self.use_python_version:
             return self.python_available
         
-        if not self.models_path.exists():
-            return False
-        
         # Check for at least one complete model (bin + param files)
-        model_files = list(self.models_path.glob("*.bin"))
-        return len(model_files) > 0
+        return len(self.ncnn.installed_models) > 0
     
     def list_models(self) -> List[str]:
         """List available models"""
         if self.use_python_version:
             return ["realesrgan-x4plus", "realesrnet-x4plus"] if self.python_available else []
         
-        if not self.models_path.exists():
-            return []
-        
-        available_models = []
-        for model_name in self.model_mapping.keys():
-            bin_file = self.models_path / f"{self.model_mapping[model_name]}.bin"
-            param_file = self.models_path / f"{self.model_mapping[model_name]}.param"
-            
-            if bin_file.exists() and param_file.exists():
-                available_models.append(model_name)
-        
-        return available_models
+        return self.ncnn.list_models()
     
     async def upscale(
         self,
@@ -110,6 +208,36 @@ class RealESRGANUpscaler:
         else:
             return await self._upscale_ncnn(input_path, output_path, scale, model, tile_size)
     
+    async def upscale_array(self, image, scale: int = 4, model: Optional[str] = None):
+        """
+        Upscale an in-memory image through the batch scheduler, without temp files
+        
+        Args:
+            image: HxWx3 uint8 RGB (or HxW grayscale) numpy array
+            scale: Scale factor (2, 4, or 8)
+            model: Model name to use
+        
+        Returns:
+            numpy.ndarray: Upscaled uint8 array with the same channel layout
+        """
+        if not self.use_python_version:
+            # The NCNN binary only reads and writes files
+            raise Exception("In-memory upscaling not supported by ncnn backend")
+        if not self.python_available:
+            raise Exception("Python Real-ESRGAN not available")
+        
+        await self._ensure_python_upscaler(model)
+        
+        # Real-ESRGAN works on 3-channel arrays; RGB goes in and comes back as-is,
+        # with the channel order handled on device
+        if image.ndim == 3:
+            return await self.batch_scheduler.submit((image, scale, True))
+        
+        loop = asyncio.get_event_loop()
+        rgb = await loop.run_in_executor(None, cv2.cvtColor, image, cv2.COLOR_GRAY2RGB)
+        output = await self.batch_scheduler.submit((rgb, scale, True))
+        return await loop.run_in_executor(None, cv2.cvtColor, output, cv2.COLOR_RGB2GRAY)
+    
     async def _upscale_python(
         self,
         input_path: str,
@@ -124,68 +252,23 @@ class RealESRGANUpscaler:
         
         try:
             # Initialize upscaler if needed
-            if self.python_upscaler is None:
-                # Select model based on request
-                if "anime" in model.lower():
-                    model_name = "RealESRGAN_x4plus_anime_6B"
-                    netscale = 4
-                else:
-                    model_name = "RealESRGAN_x4plus"
-                    netscale = 4
-                
-                # Create model
-                model_net = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=netscale)
-                
-                # Initialize upscaler
-                self.python_upscaler = RealESRGANer(
-                    scale=netscale,
-                    model_path=f'https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/{model_name}.pth',
-                    model=model_net,
-                    tile=400,  # Use tiling for memory efficiency
-                    tile_pad=10,
-                    pre_pad=0,
-                    half=True  # Use half precision to save memory
-                )
+            await self._ensure_python_upscaler(model)
             
-            # Run upscaling in thread pool to avoid blocking
-            import asyncio
-            from concurrent.futures import ThreadPoolExecutor
+            loop = asyncio.get_event_loop()
             
-            def process_image():
-                from PIL import Image
-                import cv2
-                import numpy as np
-                
-                # Read image
-                img = cv2.imread(input_path, cv2.IMREAD_COLOR)
-                
-                # Process with Real-ESRGAN
-                output, _ = self.python_upscaler.enhance(img, outscale=scale/4)
-                
-                # Handle different scales
-                if scale != 4:
-                    from PIL import Image
-                    pil_img = Image.fromarray(cv2.cvtColor(output, cv2.COLOR_BGR2RGB))
-                    
-                    if scale == 2:
-                        new_size = (pil_img.width // 2, pil_img.height // 2)
-                    elif scale == 8:
-                        new_size = (pil_img.width * 2, pil_img.height * 2)
-                    else:
-                        new_size = (pil_img.width, pil_img.height)
-                    
-                    pil_img = pil_img.resize(new_size, Image.Resampling.LANCZOS)
-                    output = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-                
-                # Save result
-                cv2.imwrite(output_path, output)
+            # Read image in thread pool to avoid blocking
+            img = await loop.run_in_executor(None, cv2.imread, input_path, cv2.IMREAD_COLOR)
+            if img is None:
+                raise Exception(f"Could not read input image: {input_path}")
+            
+            # Concurrent requests with the same input size and scale share one forward pass
+            output = await self.batch_scheduler.submit((img, scale, False))
+            
+            def save_output():
+                cv2.imwrite(output_path, output, [cv2.IMWRITE_PNG_COMPRESSION, 1])
                 return True
             
-            # Run in thread pool
-            with ThreadPoolExecutor(max_workers=1) as executor:
-                future = executor.submit(process_image)
-                result = await asyncio.get_event_loop().run_in_executor(None, future.result)
-                return result
+            return await loop.run_in_executor(None, save_output)
                 
         except Exception as e:
             raise Exception(f"Python upscaling failed: {str(e)}")
@@ -200,88 +283,10 @@ class RealESRGANUpscaler:
     ) -> bool:
         """Upscale using NCNN-Vulkan binary"""
         
-        if not self.check_binary():
+        if not self.backends['ncnn']['available']:
             raise Exception("Real-ESRGAN binary not found or not executable")
         
-        # Validate model
-        if model not in self.model_mapping:
-            model = "realesrgan-x4plus"  # Default fallback
-        
-        model_name = self.model_mapping[model]
-        
-        # Check if model files exist
-        bin_file = self.models_path / f"{model_name}.bin"
-        param_file = self.models_path / f"{model_name}.param"
-        
-        if not (bin_file.exists() and param_file.exists()):
-            raise Exception(f"Model files not found for {model}")
-        
-        # Handle different scales
-        if scale == 2:
-            actual_scale = 4
-            resize_after = True
-            final_scale = 2
-        elif scale == 8:
-            actual_scale = 4
-            resize_after = True
-            final_scale = 8
-        else:
-            actual_scale = scale
-            resize_after = False
-            final_scale = scale
-        
-        # Build command for Real-ESRGAN NCNN-Vulkan
-        cmd = [
-            str(self.binary_path),
-            "-i", input_path,
-            "-o", output_path if not resize_after else output_path.replace('.png', '_temp.png'),
-            "-s", str(actual_scale),
-            "-t", str(tile_size),
-            "-m", str(self.models_path),
-            "-n", model_name,
-            "-j", "1:2:1",  # Low memory configuration
-            "-f", "png"
-        ]
-        
-        try:
-            # Run Real-ESRGAN process
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode != 0:
-                error_msg = stderr.decode() if stderr else "Unknown error"
-                raise Exception(f"Real-ESRGAN process failed: {error_msg}")
-            
-            # Handle post-processing for 2x and 8x scales
-            if resize_after:
-                temp_output = output_path.replace('.png', '_temp.png')
-                await self._resize_image(temp_output, output_path, final_scale / actual_scale)
-                # Clean up temp file
-                if os.path.exists(temp_output):
-                    os.remove(temp_output)
-            
-            # Verify output file exists
-            return os.path.exists(output_path)
-            
-        except Exception as e:
-            raise Exception(f"Upscaling failed: {str(e)}")
-    
-    async def _resize_image(self, input_path: str, output_path: str, scale_factor: float):
-        """Resize image using PIL for 2x/8x scaling"""
-        from PIL import Image
-        
-        with Image.open(input_path) as img:
-            new_width = int(img.width * scale_factor)
-            new_height = int(img.height * scale_factor)
-            
-            # Use high-quality resampling
-            resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            resized.save(output_path, 'PNG')
+        return await self.ncnn.upscale(input_path, output_path, scale, model, tile_size)
     
     def get_memory_usage_estimate(self, image_width: int, image_height: int, scale: int) -> dict:
         """Estimate memory usage for processing"""
@@ -305,5 +310,6 @@ class RealESRGANUpscaler:
             "processing_memory_mb": round(processing_memory_mb, 1),
             "total_estimated_mb": round(total_memory_mb, 1),
             "backend": "python" if self.use_python_version else "ncnn-vulkan",
-            "recommended_tile_size": 400 if self.use_python_version else 512
+            "recommended_tile_size": 400 if self.use_python_version else 512,
+            "quality": "high"
         }
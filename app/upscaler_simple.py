@@ -6,9 +6,39 @@ Works with or without Real-ESRGAN dependencies using PIL fallback
 import os
 import asyncio
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional
 import tempfile
 
+import numpy as np
+
+# Only the Real-ESRGAN Python path needs OpenCV; imported once here, not per request
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+
+# Single thread owns the model: RealESRGANer keeps per-call state on the instance,
+# and one worker keeps concurrent requests from contending for the GPU
+gpu_executor = ThreadPoolExecutor(max_workers=1)
+
+# PIL releases the GIL while resampling and filtering, so the fallback splits work
+# into horizontal bands of at least PIL_BAND_ROWS output rows across all cores
+PIL_THREADS = os.cpu_count() or 1
+pil_executor = ThreadPoolExecutor(max_workers=PIL_THREADS)
+PIL_BAND_ROWS = 256
+# Rows of context around each band for UnsharpMask's blur kernel
+PIL_SHARPEN_MARGIN = 16
+
+# Per-backend (base MB, MB per upscaled pixel) for get_memory_usage_estimate
+MEMORY_PROFILES = {
+    'realesrgan': (1200, 0.000012),
+    'ncnn': (800, 0.000008),
+    'pil': (100, 0.000004),
+    'none': (50, 0.000002)
+}
+
 
 class RealESRGANUpscaler:
     """Real-ESRGAN upscaler with multiple fallback strategies"""
@@ -18,6 +48,9 @@ class RealESRGANUpscaler:
         self.models_path = Path("models")
         self.temp_path = Path("temp")
         
+        # RealESRGANer instances by weights name, built once on the GPU thread
+        self._upscaler_cache = {}
+        
         # Initialize backends
         self.backends = self._init_backends()
         self.active_backend = self._select_backend()
@@ -33,11 +66,11 @@ class RealESRGANUpscaler:
         
         # Try Real-ESRGAN Python
         try:
-            from realesrgan import RealESRGANer
-            from realesrgan.archs.rrdbnet_arch import RRDBNet
+            from app.fast_realesrgan import FastRealESRGANer
+            from basicsr.archs.rrdbnet_arch import RRDBNet
             backends['realesrgan'] = {
                 'available': True,
-                'RealESRGANer': RealESRGANer,
+                'RealESRGANer': FastRealESRGANer,
                 'RRDBNet': RRDBNet
             }
             print("✅ Real-ESRGAN Python backend available")
@@ -56,9 +89,12 @@ class RealESRGANUpscaler:
         
         # PIL fallback (always available)
         try:
+            import PIL
             from PIL import Image, ImageFilter
-            backends['pil'] = {'available': True, 'Image': Image, 'ImageFilter': ImageFilter}
-            print("✅ PIL fallback available")
+            # Pillow-SIMD releases carry a .postN suffix (e.g. 9.5.0.post1)
+            simd = '.post' in PIL.__version__
+            backends['pil'] = {'available': True, 'Image': Image, 'ImageFilter': ImageFilter, 'simd': simd}
+            print(f"✅ PIL fallback available{' (Pillow-SIMD)' if simd else ''}")
         except ImportError:
             backends['pil'] = {'available': False}
         
@@ -141,64 +177,110 @@ class RealESRGANUpscaler:
         else:
             raise Exception("No upscaling backend available")
     
+    def _realesrgan_model_name(self, model: Optional[str]) -> str:
+        """Map a requested model to its weights name"""
+        if "anime" in str(model).lower():
+            return "RealESRGAN_x4plus_anime_6B"
+        return "RealESRGAN_x4plus"
+    
+    def _get_realesrgan(self, model: Optional[str]):
+        """
+        Return the RealESRGANer for a model, creating it on first use
+        
+        Only call this on gpu_executor: the single worker also serializes first-time creation.
+        """
+        model_name = self._realesrgan_model_name(model)
+        if model_name not in self._upscaler_cache:
+            self._upscaler_cache[model_name] = self._create_realesrgan(model)
+        return self._upscaler_cache[model_name]
+    
+    def _create_realesrgan(self, model: Optional[str]):
+        """Create a RealESRGANer instance for the requested model"""
+        RealESRGANer = self.backends['realesrgan']['RealESRGANer']
+        RRDBNet = self.backends['realesrgan']['RRDBNet']
+        
+        # Select model
+        model_name = self._realesrgan_model_name(model)
+        netscale = 4
+        
+        # Create model
+        model_net = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=netscale)
+        
+        # Initialize upscaler (FP16 only on CUDA; CPU conv kernels don't support Half)
+        from app.fast_realesrgan import select_tile_settings, compile_model
+        from app.weights import ensure_weights
+        torch = self.backends['basicsr']['torch']
+        tile, tile_pad = select_tile_settings()
+        upscaler = RealESRGANer(
+            scale=netscale,
+            model_path=ensure_weights(model_name),
+            model=model_net,
+            tile=tile,
+            tile_pad=tile_pad,
+            pre_pad=0,
+            half=torch.cuda.is_available()
+        )
+        
+        # Instances are cached, so the compile cost is paid once per model
+        compile_model(upscaler)
+        return upscaler
+    
+    async def upscale_array(self, image, scale: int = 4, model: Optional[str] = None):
+        """
+        Upscale an in-memory image without touching disk
+        
+        Args:
+            image: HxWx3 uint8 RGB (or HxW grayscale) numpy array
+            scale: Scale factor (2, 4, or 8)
+            model: Model name to use
+        
+        Returns:
+            numpy.ndarray: Upscaled uint8 array with the same channel layout
+        """
+        if self.active_backend == 'realesrgan':
+            def process():
+                # Fetched in the worker thread, a first-time weight download can't block the event loop
+                upscaler = self._get_realesrgan(model)
+                
+                # RGB in and out directly, the channel order is handled on device
+                if image.ndim == 3:
+                    return upscaler.enhance_batch([image], scale, rgb=True)[0]
+                output, _ = upscaler.enhance(image, outscale=scale)
+                return output
+        elif self.active_backend == 'pil':
+            Image = self.backends['pil']['Image']
+            
+            def process():
+                return np.asarray(self._resize_pil(Image.fromarray(image), scale))
+        else:
+            # The NCNN binary only reads and writes files
+            raise Exception(f"In-memory upscaling not supported by {self.active_backend} backend")
+        
+        executor = gpu_executor if self.active_backend == 'realesrgan' else None
+        return await asyncio.get_event_loop().run_in_executor(executor, process)
+    
     async def _upscale_realesrgan(self, input_path: str, output_path: str, scale: int, model: str) -> bool:
         """Upscale using Real-ESRGAN Python"""
         try:
-            RealESRGANer = self.backends['realesrgan']['RealESRGANer']
-            RRDBNet = self.backends['realesrgan']['RRDBNet']
+            loop = asyncio.get_event_loop()
             
-            # Select model
-            if "anime" in str(model).lower():
-                model_name = "RealESRGAN_x4plus_anime_6B"
-                netscale = 4
-            else:
-                model_name = "RealESRGAN_x4plus"
-                netscale = 4
+            # Decode and encode on the default pool so the GPU thread only runs inference
+            img = await loop.run_in_executor(None, cv2.imread, input_path, cv2.IMREAD_COLOR)
+            if img is None:
+                raise Exception(f"Could not read input image: {input_path}")
             
-            # Create model
-            model_net = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=netscale)
-            
-            # Initialize upscaler
-            upscaler = RealESRGANer(
-                scale=netscale,
-                model_path=f'https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/{model_name}.pth',
-                model=model_net,
-                tile=400,
-                tile_pad=10,
-                pre_pad=0,
-                half=True
-            )
-            
-            # Process in thread
             def process():
-                import cv2
-                img = cv2.imread(input_path, cv2.IMREAD_COLOR)
-                output, _ = upscaler.enhance(img, outscale=scale/4)
-                
-                # Handle different scales
-                if scale != 4:
-                    from PIL import Image
-                    import numpy as np
-                    pil_img = Image.fromarray(cv2.cvtColor(output, cv2.COLOR_BGR2RGB))
-                    
-                    if scale == 2:
-                        new_size = (pil_img.width // 2, pil_img.height // 2)
-                    elif scale == 8:
-                        new_size = (pil_img.width * 2, pil_img.height * 2)
-                    else:
-                        new_size = (pil_img.width, pil_img.height)
-                    
-                    pil_img = pil_img.resize(new_size, Image.Resampling.LANCZOS)
-                    output = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-                
-                cv2.imwrite(output_path, output)
-                return True
+                upscaler = self._get_realesrgan(model)
+                # outscale is relative to the input size
+                output, _ = upscaler.enhance(img, outscale=scale)
+                return output
             
-            # Run in executor
-            from concurrent.futures import ThreadPoolExecutor
-            with ThreadPoolExecutor(max_workers=1) as executor:
-                future = executor.submit(process)
-                return await asyncio.get_event_loop().run_in_executor(None, future.result)
+            # Run on the thread that owns the model
+            output = await loop.run_in_executor(gpu_executor, process)
+            
+            return await loop.run_in_executor(
+                None, cv2.imwrite, output_path, output, [cv2.IMWRITE_PNG_COMPRESSION, 1]
+            )
                 
         except Exception as e:
             print(f"Real-ESRGAN processing failed: {e}")
@@ -210,46 +292,62 @@ class RealESRGANUpscaler:
         # ... (keeping original NCNN code)
         return False  # Placeholder
     
+    def _resize_pil(self, img, scale: int):
+        """Single LANCZOS upscale with sharpening, returns a new PIL image"""
+        Image = self.backends['pil']['Image']
+        ImageFilter = self.backends['pil']['ImageFilter']
+        
+        # Convert to RGB if needed
+        if img.mode in ('RGBA', 'P', 'LA'):
+            img = img.convert('RGB')
+        img.load()
+        
+        # LANCZOS is separable and anti-aliased, so one resize to the final size matches
+        # repeated 2x steps at a fraction of the pixel work; sharpen once at the end
+        width, height = img.width * scale, img.height * scale
+        sharpen = ImageFilter.UnsharpMask(radius=1, percent=150, threshold=3)
+        
+        band_count = min(PIL_THREADS, height // PIL_BAND_ROWS)
+        if band_count <= 1:
+            return img.resize((width, height), Image.Resampling.LANCZOS).filter(sharpen)
+        
+        band_rows = -(-height // band_count)
+        bands = [(top, min(top + band_rows, height)) for top in range(0, height, band_rows)]
+        
+        def resize_band(band):
+            # The filter still reads source rows outside the box, so bands match a full resize exactly
+            top, bottom = band
+            return img.resize((width, bottom - top), Image.Resampling.LANCZOS, box=(0, top / scale, img.width, bottom / scale))
+        
+        resized = Image.new(img.mode, (width, height))
+        for (top, _), part in zip(bands, pil_executor.map(resize_band, bands)):
+            resized.paste(part, (0, top))
+        
+        def sharpen_band(band):
+            top, bottom = band
+            context_top = max(top - PIL_SHARPEN_MARGIN, 0)
+            context_bottom = min(bottom + PIL_SHARPEN_MARGIN, height)
+            part = resized.crop((0, context_top, width, context_bottom)).filter(sharpen)
+            return part.crop((0, top - context_top, width, bottom - context_top))
+        
+        result = Image.new(img.mode, (width, height))
+        for (top, _), part in zip(bands, pil_executor.map(sharpen_band, bands)):
+            result.paste(part, (0, top))
+        return result
+    
     async def _upscale_pil(self, input_path: str, output_path: str, scale: int) -> bool:
         """Upscale using PIL (fallback method)"""
         try:
             Image = self.backends['pil']['Image']
-            ImageFilter = self.backends['pil']['ImageFilter']
             
             def process():
                 # Open image
                 with Image.open(input_path) as img:
-                    # Convert to RGB if needed
-                    if img.mode in ('RGBA', 'P', 'LA'):
-                        img = img.convert('RGB')
-                    
-                    # Calculate new size
-                    new_width = img.width * scale
-                    new_height = img.height * scale
-                    
-                    # Apply multiple upscaling passes for better quality
-                    current_img = img
-                    current_scale = 1
-                    
-                    while current_scale < scale:
-                        step_scale = min(2, scale / current_scale)
-                        new_w = int(current_img.width * step_scale)
-                        new_h = int(current_img.height * step_scale)
-                        
-                        # Use high-quality resampling
-                        current_img = current_img.resize((new_w, new_h), Image.Resampling.LANCZOS)
-                        
-                        # Apply sharpening filter
-                        current_img = current_img.filter(ImageFilter.UnsharpMask(radius=1, percent=150, threshold=3))
-                        
-                        current_scale *= step_scale
-                    
-                    # Final resize to exact target
-                    if current_img.size != (new_width, new_height):
-                        current_img = current_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+                    current_img = self._resize_pil(img, scale)
                     
                     # Save result
-                    current_img.save(output_path, 'PNG', optimize=True)
+                    # Fast deflate; optimize=True re-runs compression for a few % smaller files
+                    current_img.save(output_path, 'PNG', compress_level=1)
                     return True
             
             # Run in executor to avoid blocking
@@ -262,18 +360,7 @@ class RealESRGANUpscaler:
     def get_memory_usage_estimate(self, image_width: int, image_height: int, scale: int) -> dict:
         """Estimate memory usage for processing"""
         
-        if self.active_backend == 'realesrgan':
-            base_memory_mb = 1200
-            memory_per_pixel = 0.000012
-        elif self.active_backend == 'ncnn':
-            base_memory_mb = 800
-            memory_per_pixel = 0.000008
-        elif self.active_backend == 'pil':
-            base_memory_mb = 100
-            memory_per_pixel = 0.000004
-        else:
-            base_memory_mb = 50
-            memory_per_pixel = 0.000002
+        base_memory_mb, memory_per_pixel = MEMORY_PROFILES.get(self.active_backend, MEMORY_PROFILES['none'])
         
         pixels = image_width * image_height
         processing_memory_mb = pixels * memory_per_pixel * scale * scale
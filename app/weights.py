@@ -0,0 +1,55 @@
+"""
+Model Weights Module
+Downloads Real-ESRGAN weights once and reuses them across container starts
+"""
+
+import os
+from pathlib import Path
+
+import httpx
+
+
+WEIGHTS_DIR = Path(os.environ.get("WEIGHTS_DIR", "models"))
+WEIGHTS_URL = "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/{model_name}.pth"
+
+
+def ensure_weights(model_name: str) -> str:
+    """
+    Return the local path of a model's weights, downloading them if missing
+
+    The download goes to a temporary file that is only renamed into place once
+    complete, so an interrupted fetch or a concurrent start sharing the volume
+    never leaves a truncated .pth behind.
+
+    Args:
+        model_name: Release asset name without extension (e.g. RealESRGAN_x4plus)
+
+    Returns:
+        str: Path to the .pth file
+    """
+    path = WEIGHTS_DIR / f"{model_name}.pth"
+    if path.exists():
+        return str(path)
+
+    WEIGHTS_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    url = WEIGHTS_URL.format(model_name=model_name)
+    print(f"⬇️ Downloading {model_name} weights from {url}")
+
+    try:
+        with httpx.stream("GET", url, follow_redirects=True, timeout=60) as response:
+            response.raise_for_status()
+            expected = int(response.headers.get("content-length", 0))
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_bytes(chunk_size=1024 * 1024):
+                    f.write(chunk)
+
+        if expected and tmp_path.stat().st_size != expected:
+            raise Exception(f"Incomplete download for {model_name}: {tmp_path.stat().st_size}/{expected} bytes")
+
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    return str(path)
@@ -4,23 +4,118 @@ Real-ESRGAN API Test Script
 Tests both file upload and base64 endpoints
 """
 
+import functools
+import binascii
+import mmap
+import os
 import requests
-import base64
+from requests.adapters import HTTPAdapter
+import gzip
 import json
+import mimetypes
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+# pybase64 is a SIMD drop-in for the stdlib codec, several times faster on MB-sized images
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# orjson serializes and parses the MB-sized base64 string in one pass, several times faster than json
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+    json_loads = json.loads
+
+# blake3 hashes the image at memory bandwidth, so the raw test can ask for a cached result before uploading
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
 # Configuration
 API_BASE_URL = "https://your-domain.easypanel.host"  # Replace with your API URL
 TEST_IMAGE_PATH = "test_image.jpg"  # Replace with your test image path
+# Gzip JSON request bodies (the API inflates them); set False for servers that do not
+COMPRESS_REQUESTS = True
+
+# One keep-alive session for every request, so the TCP and TLS handshakes are paid once
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=0))
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=0))
+
+# Base64 characters decoded per write when saving results (a multiple of 4)
+DECODE_CHUNK_CHARS = 1024 * 1024
+# First character outside the base64 alphabet, to report where a bad result breaks
+INVALID_BASE64_CHAR = re.compile(r'[^A-Za-z0-9+/=]')
+
+def save_base64_image(image_base64: str, path: str):
+    """Decode a base64 image into a file chunk by chunk, never holding the whole decoded image"""
+    with open(path, 'wb') as f:
+        if hasattr(os, 'posix_fallocate'):
+            # Reserve the decoded size up front so the chunked writes land in one extent
+            os.posix_fallocate(f.fileno(), 0, len(image_base64) // 4 * 3 - image_base64[-2:].count('='))
+        for start in range(0, len(image_base64), DECODE_CHUNK_CHARS):
+            chunk = image_base64[start:start + DECODE_CHUNK_CHARS]
+            try:
+                # validate rejects stray characters in the same pass instead of silently skipping them
+                f.write(base64.b64decode(chunk, validate=True))
+            except binascii.Error as e:
+                bad = INVALID_BASE64_CHAR.search(chunk)
+                offset = start + (bad.start() if bad else 0)
+                raise ValueError(f"Invalid base64 image near offset {offset}: {e}") from None
+
+@functools.lru_cache(maxsize=4)
+def encode_file_base64(path: str) -> bytes:
+    """Base64 of a file, encoded straight from the mapped file and cached across tests"""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return base64.b64encode(mapped)
+
+@functools.lru_cache(maxsize=4)
+def hash_file_blake3(path: str):
+    """Hex blake3 of a file, streamed from the mapped file; None without the blake3 package"""
+    if blake3 is None:
+        return None
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return blake3(mapped).hexdigest()
+
+def encode_body(body: bytes, content_type: str) -> tuple:
+    """Request body and headers, gzipped if COMPRESS_REQUESTS is set; returns (body, headers)"""
+    headers = {'Content-Type': content_type}
+    if COMPRESS_REQUESTS:
+        # Base64 text compresses by roughly a fifth, and level 1 costs little CPU
+        body = gzip.compress(body, compresslevel=1)
+        headers['Content-Encoding'] = 'gzip'
+    return body, headers
+
+def json_request(payload) -> tuple:
+    """Serialize a JSON payload; returns (body, headers)"""
+    return encode_body(json_dumps(payload), 'application/json')
+
+# Failed responses are read only this far: API errors are small JSON, but a proxy may return a whole page
+ERROR_BODY_BYTES = 1024
+
+def read_error(response) -> str:
+    """Error detail of a failed streamed response, without downloading more than ERROR_BODY_BYTES"""
+    head = response.raw.read(ERROR_BODY_BYTES, decode_content=True)
+    response.close()
+    try:
+        return json.loads(head).get('detail', 'Unknown error')
+    except (ValueError, AttributeError):
+        return f"{head[:500].decode(errors='replace')}..."
 
 def test_health():
     """Test API health endpoint"""
     print("🔍 Testing API health...")
     try:
-        response = requests.get(f"{API_BASE_URL}/health")
+        response = SESSION.get(f"{API_BASE_URL}/health")
         if response.status_code == 200:
-            data = response.json()
+            data = json_loads(response.content)
             print(f"✅ API is {data['status']}")
             print(f"   Backend: {data['backend']}")
             print(f"   Quality: {data['backend_quality']}")
@@ -43,23 +138,26 @@ def test_file_upload_endpoint(image_path, scale=4):
         return None
     
     try:
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         with open(image_path, 'rb') as f:
-            files = {'file': f}
+            # The API rejects uploads without an image/* content type
+            content_type = mimetypes.guess_type(image_path)[0] or 'image/jpeg'
+            files = {'file': (Path(image_path).name, f, content_type)}
             data = {'scale': scale, 'model': 'auto'}
             
-            response = requests.post(
+            response = SESSION.post(
                 f"{API_BASE_URL}/upscale",
                 files=files,
                 data=data,
-                timeout=300  # 5 minutes timeout
+                timeout=300,  # 5 minutes timeout
+                stream=True  # error bodies are only read in part
             )
         
-        elapsed_time = time.time() - start_time
+        elapsed_time = time.perf_counter() - start_time
         
         if response.status_code == 200:
-            result = response.json()
+            result = json_loads(response.content)
             print(f"✅ Upload endpoint successful!")
             print(f"   Time: {elapsed_time:.1f}s")
             print(f"   Backend: {result['backend']}")
@@ -69,20 +167,14 @@ def test_file_upload_endpoint(image_path, scale=4):
             print(f"   Memory used: {result['memory_used_mb']:.1f}MB")
             
             # Save result
-            image_data = base64.b64decode(result['base64_image'])
             output_path = f"upscaled_upload_{scale}x.png"
-            with open(output_path, 'wb') as f:
-                f.write(image_data)
+            save_base64_image(result['base64_image'], output_path)
             print(f"   Saved: {output_path}")
             
             return result
         else:
             print(f"❌ Upload endpoint failed: {response.status_code}")
-            try:
-                error_data = response.json()
-                print(f"   Error: {error_data.get('detail', 'Unknown error')}")
-            except:
-                print(f"   Error: {response.text}")
+            print(f"   Error: {read_error(response)}")
             return None
             
     except requests.exceptions.Timeout:
@@ -92,9 +184,10 @@ def test_file_upload_endpoint(image_path, scale=4):
         print(f"❌ Upload endpoint error: {e}")
         return None
 
-def test_base64_endpoint(image_path, scale=4):
-    """Test the /upscale-base64 endpoint (JSON with base64)"""
-    print(f"\n🔤 Testing base64 endpoint...")
+def test_base64_endpoint(image_path, scale=4, raw=False):
+    """Test the /upscale-base64 endpoint (JSON with base64), or /upscale-base64-raw (bare base64 body) if raw"""
+    name = "Base64 raw" if raw else "Base64"
+    print(f"\n🔤 Testing {name.lower()} endpoint...")
     print(f"   Image: {image_path}")
     print(f"   Scale: {scale}x")
     
@@ -103,34 +196,52 @@ def test_base64_endpoint(image_path, scale=4):
         return None
     
     try:
-        # Convert image to base64
-        with open(image_path, 'rb') as f:
-            image_data = f.read()
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
+        image_base64 = encode_file_base64(image_path)
         
         print(f"   Base64 size: {len(image_base64)} chars")
         
-        payload = {
-            "image_base64": image_base64,
-            "scale": scale,
-            "model": "auto",
-            "format": "auto"
-        }
+        if raw:
+            # The encoded bytes are the body as-is, parameters go in the query string
+            url = f"{API_BASE_URL}/upscale-base64-raw?scale={scale}&model=auto&format=auto"
+            body, headers = encode_body(image_base64, 'application/base64')
+        else:
+            url = f"{API_BASE_URL}/upscale-base64"
+            payload = {
+                "image_base64": image_base64.decode('ascii'),
+                "scale": scale,
+                "model": "auto",
+                "format": "auto"
+            }
+            body, headers = json_request(payload)
         
-        start_time = time.time()
+        start_time = time.perf_counter()
         
-        response = requests.post(
-            f"{API_BASE_URL}/upscale-base64",
-            json=payload,
-            headers={'Content-Type': 'application/json'},
-            timeout=300  # 5 minutes timeout
-        )
+        response = None
+        image_hash = hash_file_blake3(image_path) if raw else None
+        if image_hash:
+            # Hash only first: a repeated image is answered from the server cache without the upload
+            response = SESSION.post(url, headers={'X-Image-Blake3': image_hash}, timeout=300, stream=True)
+            if response.status_code == 200:
+                print("   Served from cache by hash")
+            else:
+                # 404 is a cache miss; any other error also falls back to the full upload
+                response.close()
+                response = None
         
-        elapsed_time = time.time() - start_time
+        if response is None:
+            response = SESSION.post(
+                url,
+                data=body,
+                headers=headers,
+                timeout=300,  # 5 minutes timeout
+                stream=True  # error bodies are only read in part
+            )
+        
+        elapsed_time = time.perf_counter() - start_time
         
         if response.status_code == 200:
-            result = response.json()
-            print(f"✅ Base64 endpoint successful!")
+            result = json_loads(response.content)
+            print(f"✅ {name} endpoint successful!")
             print(f"   Time: {elapsed_time:.1f}s")
             print(f"   Backend: {result['backend']}")
             print(f"   Quality: {result['backend_quality']}")
@@ -139,27 +250,21 @@ def test_base64_endpoint(image_path, scale=4):
             print(f"   Memory used: {result['memory_used_mb']:.1f}MB")
             
             # Save result
-            image_data = base64.b64decode(result['base64_image'])
-            output_path = f"upscaled_base64_{scale}x.png"
-            with open(output_path, 'wb') as f:
-                f.write(image_data)
+            output_path = f"upscaled_base64{'_raw' if raw else ''}_{scale}x.png"
+            save_base64_image(result['base64_image'], output_path)
             print(f"   Saved: {output_path}")
             
             return result
         else:
-            print(f"❌ Base64 endpoint failed: {response.status_code}")
-            try:
-                error_data = response.json()
-                print(f"   Error: {error_data.get('detail', 'Unknown error')}")
-            except:
-                print(f"   Error: {response.text}")
+            print(f"❌ {name} endpoint failed: {response.status_code}")
+            print(f"   Error: {read_error(response)}")
             return None
             
     except requests.exceptions.Timeout:
-        print("❌ Base64 endpoint timeout (>5 minutes)")
+        print(f"❌ {name} endpoint timeout (>5 minutes)")
         return None
     except Exception as e:
-        print(f"❌ Base64 endpoint error: {e}")
+        print(f"❌ {name} endpoint error: {e}")
         return None
 
 def compare_results(result1, result2):
@@ -201,12 +306,18 @@ def main():
         print("   Continuing with endpoints that don't require image...")
         return
     
-    # Test both endpoints
-    result1 = test_file_upload_endpoint(TEST_IMAGE_PATH, scale=4)
-    result2 = test_base64_endpoint(TEST_IMAGE_PATH, scale=4)
+    # Test all endpoints at once; they share no state, so their network waits
+    # overlap (output may interleave, and each elapsed time includes the others' load)
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        future1 = pool.submit(test_file_upload_endpoint, TEST_IMAGE_PATH, scale=4)
+        future2 = pool.submit(test_base64_endpoint, TEST_IMAGE_PATH, scale=4)
+        future3 = pool.submit(test_base64_endpoint, TEST_IMAGE_PATH, scale=4, raw=True)
+        result1, result2, result3 = future1.result(), future2.result(), future3.result()
     
     # Compare results
     compare_results(result1, result2)
+    if result2 and result3 and result2['upscaled_size'] == result3['upscaled_size']:
+        print("✅ JSON and raw base64 endpoints returned the same size")
     
     print(f"\n🎉 Tests completed!")
     print("   Check the generated upscaled_*.png files")